@@ -1,25 +1,122 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from typing import Optional
+import logging
 import os
+from app.database.pool import pool_settings, engine_kwargs, pool_status
+from app.database.query_log import install_query_log
+from app.database.replicas import Replica, ReplicaRouter, must_read_primary
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("La variable de entorno DATABASE_URL no está definida")
+# Réplicas de lectura separadas por coma; vacío = todas las lecturas al primario.
+DATABASE_REPLICA_URLS = [
+    url.strip().replace("postgresql://", "postgresql+asyncpg://")
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "10"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
 
-DATABASE_URL_ASYNC = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
 
-async_engine = create_async_engine(DATABASE_URL_ASYNC, echo=True)
-
-AsyncSessionLocal = sessionmaker(
-    async_engine, expire_on_commit=False, class_=AsyncSession
-)
+# El engine y las réplicas se crean en el primer uso, no al importar el módulo.
+AsyncSessionLocal = sessionmaker(expire_on_commit=False, class_=AsyncSession)
 
 Base = declarative_base()
 
+_async_engine = None
+_replica_router: Optional[ReplicaRouter] = None
+
+def _create_engine(url: str):
+    engine = create_async_engine(url, echo=DB_ECHO, **engine_kwargs(pool_settings()))
+    install_query_log(engine)
+    return engine
+
+def get_async_engine():
+    """Engine del primario, creado la primera vez que se necesita."""
+    global _async_engine
+    if _async_engine is None:
+        if not DATABASE_URL:
+            raise ValueError("La variable de entorno DATABASE_URL no está definida")
+        _async_engine = _create_engine(DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"))
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+def get_replica_router() -> ReplicaRouter:
+    global _replica_router
+    if _replica_router is None:
+        replicas = [
+            Replica(f"replica-{i}", _create_engine(url))
+            for i, url in enumerate(DATABASE_REPLICA_URLS)
+        ]
+        _replica_router = ReplicaRouter(replicas, retry_seconds=REPLICA_RETRY_SECONDS)
+    return _replica_router
+
+def __getattr__(name):
+    # Compatibilidad con `from app.database.db import async_engine`.
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def new_session() -> AsyncSession:
+    get_async_engine()
+    return AsyncSessionLocal()
+
 async def get_async_db():
-    async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+    async with new_session() as session:
+        yield session
+
+@asynccontextmanager
+async def read_session(cookies: Optional[dict] = None):
+    """Sesión de lectura: réplica sana o primario como respaldo.
+
+    Los clientes que escribieron hace menos de READ_YOUR_WRITES_SECONDS
+    leen del primario para ver sus propios cambios.
+    """
+    router = get_replica_router()
+    replica = None if must_read_primary(cookies or {}) else router.choose()
+    if replica is not None:
+        session = AsyncSession(replica.engine, expire_on_commit=False)
+        try:
+            await session.connection()
+        except Exception as e:
+            await session.close()
+            replica.mark_failed(e, REPLICA_RETRY_SECONDS)
+            logging.warning(f"Leyendo del primario por fallo en {replica.name}.")
+        else:
+            async with session:
+                yield session
+            return
+    async with new_session() as session:
+        yield session
+
+async def get_async_read_db(request: Request):
+    """Dependencia para GET seguros; ver `read_session`."""
+    async with read_session(request.cookies) as session:
+        yield session
+
+def get_pool_status() -> dict:
+    """Métricas en vivo del pool del engine principal y de las réplicas."""
+    estado = pool_status(get_async_engine().pool)
+    replicas = get_replica_router().replicas
+    if replicas:
+        estado["replicas"] = {r.name: pool_status(r.engine.pool) for r in replicas}
+    return estado
+
+def get_replica_status() -> list:
+    return get_replica_router().status()
+
+async def dispose_engines():
+    """Cierra los pools abiertos (apagado ordenado)."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _replica_router is not None:
+        for replica in _replica_router.replicas:
+            await replica.engine.dispose()
@@ -0,0 +1,444 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import re
+import urllib.parse
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Union
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import DBAPIError
+
+# Clave del advisory lock que serializa las migraciones entre workers.
+MIGRATION_LOCK_KEY = 724311
+
+@dataclass(frozen=True)
+class Migration:
+    """Revisión del esquema: SQL idempotente o una función async que recibe la conexión."""
+    revision: str
+    description: str
+    upgrade: Union[str, Callable[..., Awaitable[None]]]
+
+    def fingerprint(self) -> str:
+        # El código fuente de la función y de los helpers de este módulo que
+        # usa, no solo su nombre: editar una migración ya aplicada cambia el checksum.
+        if isinstance(self.upgrade, str):
+            cuerpo = self.upgrade
+        else:
+            cuerpo = "".join(inspect.getsource(f) for f in _funciones_usadas(self.upgrade))
+        return f"{self.revision}:{cuerpo}"
+
+def _funciones_usadas(funcion) -> List[Callable]:
+    """`funcion` y, recursivamente, las funciones de este módulo que nombra (en orden)."""
+    vistas: List[Callable] = []
+    pendientes = [funcion]
+    while pendientes:
+        actual = pendientes.pop(0)
+        if actual in vistas:
+            continue
+        vistas.append(actual)
+        codigos = [actual.__code__]
+        while codigos:
+            codigo = codigos.pop()
+            codigos.extend(c for c in codigo.co_consts if inspect.iscode(c))
+            for nombre in codigo.co_names:
+                valor = globals().get(nombre)
+                if inspect.isfunction(valor) and valor.__module__ == __name__:
+                    pendientes.append(valor)
+    return vistas
+
+# ---------------------- HELPERS CONGELADOS ----------------------
+# Copias de helpers de la app tal como estaban al publicar cada migración.
+# Una migración no importa código vivo: si cambia parse_rutas o key_from_url,
+# las revisiones ya aplicadas deben seguir haciendo exactamente lo mismo.
+_RUTAS_SEP_0004 = re.compile(r"[,;|/\s]+")
+_RUTAS_SEP_0010 = re.compile(r"[,;|]")
+
+def _parse_rutas_0004(rutas_asociadas: Optional[str]) -> List[str]:
+    """'B74, k86; B74' -> ['B74', 'K86']; también separa por espacios y '/'."""
+    if not rutas_asociadas:
+        return []
+    vistas = {}
+    for nombre in _RUTAS_SEP_0004.split(rutas_asociadas.upper()):
+        if nombre:
+            vistas.setdefault(nombre, None)
+    return list(vistas)
+
+def _parse_rutas_0010(rutas_asociadas: Optional[str]) -> List[str]:
+    """'B74, k86; Portal  Norte; B74' -> ['B74', 'K86', 'PORTAL NORTE']."""
+    if not rutas_asociadas:
+        return []
+    vistas = {}
+    for parte in _RUTAS_SEP_0010.split(rutas_asociadas.upper()):
+        nombre = " ".join(parte.split())
+        if nombre:
+            vistas.setdefault(nombre, None)
+    return list(vistas)
+
+async def _asociar_rutas(conn, pares: List[tuple]) -> None:
+    """Agrega pares (estacion_id, nombre_ruta), creando las rutas que falten."""
+    if not pares:
+        return
+    await conn.execute(
+        text(
+            "INSERT INTO rutas (nombre_ruta, activo) "
+            "SELECT DISTINCT unnest(CAST(:nombres AS VARCHAR[])), true "
+            "ON CONFLICT (nombre_ruta) DO NOTHING"
+        ),
+        {"nombres": [n for _, n in pares]},
+    )
+    await conn.execute(
+        text(
+            "INSERT INTO ruta_estacion (ruta_id, estacion_id) "
+            "SELECT r.id, p.estacion_id "
+            "FROM unnest(CAST(:eids AS INTEGER[]), CAST(:nombres AS VARCHAR[])) AS p (estacion_id, nombre) "
+            "JOIN rutas r ON r.nombre_ruta = p.nombre "
+            "ON CONFLICT DO NOTHING"
+        ),
+        {"eids": [e for e, _ in pares], "nombres": [n for _, n in pares]},
+    )
+
+def _clave_0009(valor: Optional[str], local_url: str) -> Optional[str]:
+    """Clave '<bucket>/<ruta>' de una URL pública de Supabase o del backend local;
+    las URLs externas y las claves pasan tal cual."""
+    if not valor:
+        return valor
+    if "/object/public/" in valor:
+        return urllib.parse.unquote(valor.split("/object/public/", 1)[1].split("?", 1)[0])
+    if valor.startswith(local_url + "/"):
+        return urllib.parse.unquote(valor[len(local_url) + 1:].split("?", 1)[0])
+    return valor
+
+# ---------------------- MIGRACIONES ----------------------
+
+async def _rutas_estaciones(conn, batch_size: int = 500):
+    """Crea ruta_estacion y la llena a partir de estaciones.rutas_asociadas por lotes."""
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS ruta_estacion ("
+        " ruta_id INTEGER NOT NULL REFERENCES rutas (id) ON DELETE CASCADE,"
+        " estacion_id INTEGER NOT NULL REFERENCES estaciones (id) ON DELETE CASCADE,"
+        " PRIMARY KEY (ruta_id, estacion_id))"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_ruta_estacion_estacion ON ruta_estacion (estacion_id, ruta_id)"
+    ))
+
+    ultimo_id = 0
+    while True:
+        filas = (await conn.execute(
+            text("SELECT id, rutas_asociadas FROM estaciones WHERE id > :ultimo ORDER BY id LIMIT :n"),
+            {"ultimo": ultimo_id, "n": batch_size},
+        )).all()
+        if not filas:
+            break
+        pares = [(f.id, nombre) for f in filas for nombre in _parse_rutas_0004(f.rutas_asociadas)]
+        await _asociar_rutas(conn, pares)
+        ultimo_id = filas[-1].id
+
+async def _rutas_con_espacios(conn, batch_size: int = 500):
+    """Rehace ruta_estacion de las estaciones cuyo rutas_asociadas tiene espacios.
+
+    Antes también se separaba por espacios, así que "Portal Norte" quedó
+    asociada como PORTAL y NORTE. Esas rutas sueltas no se borran de `rutas`
+    (pueden existir de verdad); solo se quitan las asociaciones.
+    """
+    ultimo_id = 0
+    while True:
+        filas = (await conn.execute(
+            text(
+                "SELECT id, rutas_asociadas FROM estaciones"
+                " WHERE id > :ultimo AND rutas_asociadas ~ '\\S\\s+\\S' ORDER BY id LIMIT :n"
+            ),
+            {"ultimo": ultimo_id, "n": batch_size},
+        )).all()
+        if not filas:
+            break
+        await conn.execute(
+            text("DELETE FROM ruta_estacion WHERE estacion_id = ANY(CAST(:ids AS INTEGER[]))"),
+            {"ids": [f.id for f in filas]},
+        )
+        pares = [(f.id, nombre) for f in filas for nombre in _parse_rutas_0010(f.rutas_asociadas)]
+        await _asociar_rutas(conn, pares)
+        ultimo_id = filas[-1].id
+
+async def _claves_storage(conn, batch_size: int = 500):
+    """Cambia las URLs públicas guardadas en las filas por claves '<bucket>/<ruta>' del backend."""
+    # Solo la configuración viene de la app; la conversión está congelada en `_clave_0009`.
+    from app.services.storage import LOCAL_STORAGE_URL
+
+    def clave(valor):
+        return _clave_0009(valor, LOCAL_STORAGE_URL)
+
+    def claves_variantes(variantes):
+        if not variantes:
+            return variantes
+        return {f: {a: clave(v) for a, v in por_ancho.items()} for f, por_ancho in variantes.items()}
+
+    tiene_url = (await conn.execute(text(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'imagenes' AND column_name = 'url'"
+    ))).first()
+    if tiene_url:
+        await conn.execute(text("ALTER TABLE imagenes RENAME COLUMN url TO clave"))
+
+    filas = (await conn.execute(
+        text("SELECT bucket, sha256, clave, variantes FROM imagenes WHERE clave LIKE '%://%'").columns(variantes=JSONB)
+    )).all()
+    if filas:
+        await conn.execute(
+            text(
+                "UPDATE imagenes SET clave = :clave, variantes = :variantes WHERE bucket = :bucket AND sha256 = :sha256"
+            ).bindparams(bindparam("variantes", type_=JSONB)),
+            [
+                {"bucket": f.bucket, "sha256": f.sha256, "clave": clave(f.clave), "variantes": claves_variantes(f.variantes)}
+                for f in filas
+            ],
+        )
+
+    for tabla in ("buses", "estaciones"):
+        ultimo_id = 0
+        while True:
+            filas = (await conn.execute(
+                text(
+                    f"SELECT id, imagen, imagen_variantes FROM {tabla}"
+                    " WHERE id > :ultimo AND (imagen LIKE '%://%' OR imagen_variantes::text LIKE '%://%')"
+                    " ORDER BY id LIMIT :n"
+                ).columns(imagen_variantes=JSONB),
+                {"ultimo": ultimo_id, "n": batch_size},
+            )).all()
+            if not filas:
+                break
+            await conn.execute(
+                text(
+                    f"UPDATE {tabla} SET imagen = :imagen, imagen_variantes = :variantes WHERE id = :id"
+                ).bindparams(bindparam("variantes", type_=JSONB)),
+                [
+                    {"id": f.id, "imagen": clave(f.imagen), "variantes": claves_variantes(f.imagen_variantes)}
+                    for f in filas
+                ],
+            )
+            ultimo_id = filas[-1].id
+
+MIGRATIONS: List[Migration] = [
+    # Esquema original de los modelos, congelado: las columnas y tablas
+    # nuevas van en su propia migración, no aquí.
+    Migration(
+        "0001",
+        "Tablas iniciales rutas, buses y estaciones",
+        """
+        CREATE TABLE IF NOT EXISTS rutas (
+            id SERIAL PRIMARY KEY,
+            nombre_ruta VARCHAR,
+            tipo_servicio VARCHAR,
+            horario VARCHAR,
+            activo BOOLEAN);
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_rutas_nombre_ruta ON rutas (nombre_ruta);
+        CREATE INDEX IF NOT EXISTS ix_rutas_id ON rutas (id);
+        CREATE TABLE IF NOT EXISTS buses (
+            id SERIAL PRIMARY KEY,
+            nombre_bus VARCHAR,
+            tipo VARCHAR,
+            activo BOOLEAN,
+            imagen VARCHAR);
+        CREATE INDEX IF NOT EXISTS ix_buses_nombre_bus ON buses (nombre_bus);
+        CREATE INDEX IF NOT EXISTS ix_buses_id ON buses (id);
+        CREATE TABLE IF NOT EXISTS estaciones (
+            id SERIAL PRIMARY KEY,
+            nombre_estacion VARCHAR,
+            localidad VARCHAR,
+            rutas_asociadas VARCHAR,
+            activo BOOLEAN,
+            imagen VARCHAR);
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_estaciones_nombre_estacion ON estaciones (nombre_estacion);
+        CREATE INDEX IF NOT EXISTS ix_estaciones_id ON estaciones (id)
+        """,
+    ),
+    Migration(
+        "0002",
+        "Índices compuesto, parciales y trigram para los filtros de listado",
+        """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS ix_buses_tipo_activo ON buses (tipo, activo);
+        CREATE INDEX IF NOT EXISTS ix_buses_activos ON buses (tipo, id) WHERE activo;
+        CREATE INDEX IF NOT EXISTS ix_estaciones_activas ON estaciones (id) WHERE activo;
+        CREATE INDEX IF NOT EXISTS ix_estaciones_localidad_trgm
+            ON estaciones USING gin (lower(localidad) gin_trgm_ops)
+        """,
+    ),
+    Migration(
+        "0003",
+        "Columnas de búsqueda normalizadas con índices trigram",
+        """
+        ALTER TABLE buses ADD COLUMN IF NOT EXISTS nombre_bus_norm VARCHAR;
+        ALTER TABLE estaciones ADD COLUMN IF NOT EXISTS nombre_estacion_norm VARCHAR;
+        ALTER TABLE estaciones ADD COLUMN IF NOT EXISTS localidad_norm VARCHAR;
+        CREATE INDEX IF NOT EXISTS ix_buses_nombre_norm_trgm
+            ON buses USING gin (nombre_bus_norm gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_estaciones_nombre_norm_trgm
+            ON estaciones USING gin (nombre_estacion_norm gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_estaciones_localidad_norm_trgm
+            ON estaciones USING gin (localidad_norm gin_trgm_ops);
+        DROP INDEX IF EXISTS ix_estaciones_localidad_trgm
+        """,
+    ),
+    Migration("0004", "Asociación ruta_estacion desde rutas_asociadas", _rutas_estaciones),
+    Migration(
+        "0005",
+        "Historial de eliminaciones en Postgres",
+        """
+        CREATE TABLE IF NOT EXISTS historial_eliminados (
+            id BIGSERIAL PRIMARY KEY,
+            tipo VARCHAR NOT NULL,
+            registro_id INTEGER NOT NULL,
+            nombre_bus VARCHAR,
+            tipo_bus VARCHAR,
+            nombre_estacion VARCHAR,
+            localidad VARCHAR,
+            fecha_hora TIMESTAMPTZ NOT NULL DEFAULT now());
+        CREATE INDEX IF NOT EXISTS ix_historial_fecha_hora ON historial_eliminados (fecha_hora);
+        CREATE INDEX IF NOT EXISTS ix_historial_tipo_id ON historial_eliminados (tipo, id)
+        """,
+    ),
+    Migration(
+        "0006",
+        "Cola de trabajos en segundo plano",
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            tipo VARCHAR NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}',
+            estado VARCHAR NOT NULL DEFAULT 'pendiente',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            max_intentos INTEGER NOT NULL DEFAULT 5,
+            disponible_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+            bloqueado_en TIMESTAMPTZ,
+            ultimo_error VARCHAR,
+            creado_en TIMESTAMPTZ NOT NULL DEFAULT now());
+        CREATE INDEX IF NOT EXISTS ix_jobs_pendientes ON jobs (disponible_en) WHERE estado = 'pendiente';
+        CREATE INDEX IF NOT EXISTS ix_jobs_en_proceso ON jobs (bloqueado_en) WHERE estado = 'en_proceso'
+        """,
+    ),
+    Migration(
+        "0007",
+        "URLs de variantes redimensionadas de las imágenes",
+        """
+        ALTER TABLE buses ADD COLUMN IF NOT EXISTS imagen_variantes JSONB;
+        ALTER TABLE estaciones ADD COLUMN IF NOT EXISTS imagen_variantes JSONB
+        """,
+    ),
+    Migration(
+        "0008",
+        "Imágenes direccionadas por contenido con conteo de referencias",
+        """
+        CREATE TABLE IF NOT EXISTS imagenes (
+            bucket VARCHAR NOT NULL,
+            sha256 VARCHAR NOT NULL,
+            url VARCHAR NOT NULL UNIQUE,
+            variantes JSONB,
+            referencias INTEGER NOT NULL DEFAULT 0,
+            creado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (bucket, sha256))
+        """,
+    ),
+    Migration("0009", "Claves del backend de almacenamiento en lugar de URLs públicas", _claves_storage),
+    Migration("0010", "Rutas con espacios en ruta_estacion", _rutas_con_espacios),
+    Migration(
+        "0011",
+        "Referencias de todas las imágenes en uso, incluidas las antiguas con nombre uuid",
+        """
+        INSERT INTO imagenes (bucket, sha256, clave, referencias)
+        SELECT split_part(u.imagen, '/', 1),
+            COALESCE(substring(u.imagen from 'sha256/([0-9a-f]{64})'), 'clave:' || md5(u.imagen)),
+            u.imagen, count(*)
+        FROM (SELECT imagen FROM buses UNION ALL SELECT imagen FROM estaciones) u
+        WHERE u.imagen IS NOT NULL AND u.imagen NOT LIKE '%://%'
+        GROUP BY u.imagen
+        ON CONFLICT (clave) DO UPDATE SET referencias = EXCLUDED.referencias
+        """,
+    ),
+]
+
+def schema_checksum(migrations: Optional[List[Migration]] = None) -> str:
+    migrations = MIGRATIONS if migrations is None else migrations
+    h = hashlib.sha256()
+    for m in migrations:
+        h.update(m.fingerprint().encode())
+    return h.hexdigest()
+
+async def _stored_checksum(engine) -> Optional[str]:
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT checksum FROM schema_version WHERE id = 1"))
+            return result.scalar()
+    except DBAPIError:
+        # La tabla aún no existe: base de datos nueva.
+        return None
+
+async def _execute(conn, upgrade):
+    if isinstance(upgrade, str):
+        for sentencia in [s.strip() for s in upgrade.split(";") if s.strip()]:
+            await conn.execute(text(sentencia))
+    else:
+        await upgrade(conn)
+
+async def run_migrations(engine) -> List[str]:
+    """Aplica las revisiones pendientes y devuelve las que se ejecutaron.
+
+    En un arranque en caliente solo se lee `schema_version`; si el checksum
+    coincide no se toca el catálogo ni se toma el lock.
+    """
+    esperado = schema_checksum()
+    if await _stored_checksum(engine) == esperado:
+        return []
+
+    aplicadas: List[str] = []
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " revision VARCHAR PRIMARY KEY,"
+            " description VARCHAR,"
+            " applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1),"
+            " checksum VARCHAR NOT NULL,"
+            " updated_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        # Otro worker pudo terminar mientras esperábamos el lock.
+        actual = (await conn.execute(text("SELECT checksum FROM schema_version WHERE id = 1"))).scalar()
+        if actual == esperado:
+            return []
+
+        hechas = set((await conn.execute(text("SELECT revision FROM schema_migrations"))).scalars().all())
+        for migration in MIGRATIONS:
+            if migration.revision in hechas:
+                continue
+            logging.info(f"Aplicando migración {migration.revision}: {migration.description}")
+            await _execute(conn, migration.upgrade)
+            await conn.execute(
+                text("INSERT INTO schema_migrations (revision, description) VALUES (:r, :d)"),
+                {"r": migration.revision, "d": migration.description},
+            )
+            aplicadas.append(migration.revision)
+
+        await conn.execute(
+            text(
+                "INSERT INTO schema_version (id, checksum) VALUES (1, :c) "
+                "ON CONFLICT (id) DO UPDATE SET checksum = EXCLUDED.checksum, updated_at = now()"
+            ),
+            {"c": esperado},
+        )
+    return aplicadas
+
+if __name__ == "__main__":
+    from app.database.db import get_async_engine, dispose_engines
+
+    async def _main():
+        aplicadas = await run_migrations(get_async_engine())
+        print(f"Migraciones aplicadas: {aplicadas or 'ninguna'}")
+        await dispose_engines()
+
+    asyncio.run(_main())
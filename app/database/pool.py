@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+from asyncpg import Connection
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+# ---------------------- CONFIG ----------------------
+def _env_int(nombre: str, por_defecto: int) -> int:
+    valor = os.getenv(nombre)
+    return int(valor) if valor not in (None, "") else por_defecto
+
+def _env_bool(nombre: str, por_defecto: bool) -> bool:
+    valor = os.getenv(nombre)
+    if valor in (None, ""):
+        return por_defecto
+    return valor.strip().lower() in ("1", "true", "yes", "si", "on")
+
+def pool_settings() -> dict:
+    """Perfil del pool leído de variables de entorno (DB_POOL_*)."""
+    pgbouncer = _env_bool("DB_PGBOUNCER", False)
+    statement_cache_size = _env_int("DB_STATEMENT_CACHE_SIZE", 100)
+    if pgbouncer:
+        # En modo transacción de pgbouncer una conexión física puede cambiar
+        # entre transacciones, así que no se puede confiar en cachés del servidor.
+        statement_cache_size = 0
+    return {
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+        "statement_cache_size": statement_cache_size,
+        "pgbouncer": pgbouncer,
+    }
+
+class PgBouncerConnection(Connection):
+    """Conexión de asyncpg con nombres de sentencias, portales y savepoints únicos.
+
+    SQLAlchemy 1.4 prepara cada sentencia con nombre y asyncpg numera esos
+    nombres por proceso, así que dos workers detrás del mismo pgbouncer
+    pueden chocar en la misma conexión física ("prepared statement
+    __asyncpg_stmt_1__ already exists"). Con un uuid por nombre no chocan.
+    """
+
+    def _get_unique_id(self, prefix):
+        return f"__asyncpg_{prefix}_{uuid.uuid4().hex}__"
+
+def engine_kwargs(settings: dict) -> dict:
+    """Traduce el perfil del pool a argumentos de create_async_engine.
+
+    Con DB_PGBOUNCER el pool lo lleva pgbouncer: el engine usa NullPool
+    (una conexión por checkout, sin reutilizarla) y los parámetros DB_POOL_*
+    no aplican.
+    """
+    if settings["pgbouncer"]:
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "connection_class": PgBouncerConnection,
+            },
+        }
+    return {
+        "poolclass": InstrumentedAsyncPool,
+        "pool_size": settings["pool_size"],
+        "max_overflow": settings["max_overflow"],
+        "pool_timeout": settings["pool_timeout"],
+        "pool_recycle": settings["pool_recycle"],
+        "pool_pre_ping": settings["pool_pre_ping"],
+        "connect_args": {
+            "statement_cache_size": settings["statement_cache_size"],
+            "prepared_statement_cache_size": settings["statement_cache_size"],
+        },
+    }
+
+# ---------------------- METRICS ----------------------
+# Límites superiores (ms) de los buckets del histograma de espera.
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+class PoolMetrics:
+    """Contadores del pool: espera por conexión, overflow y timeouts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.wait_buckets: List[int] = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.wait_count = 0
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.overflow_events = 0
+            self.timeouts = 0
+
+    def observe_wait(self, elapsed_ms: float):
+        with self._lock:
+            for i, limite in enumerate(WAIT_BUCKETS_MS):
+                if elapsed_ms <= limite:
+                    self.wait_buckets[i] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+            self.wait_count += 1
+            self.wait_total_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+
+    def observe_overflow(self):
+        with self._lock:
+            self.overflow_events += 1
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            histograma = {f"le_{limite}ms": n for limite, n in zip(WAIT_BUCKETS_MS, self.wait_buckets)}
+            histograma["le_inf"] = self.wait_buckets[-1]
+            return {
+                "wait_count": self.wait_count,
+                "wait_avg_ms": round(self.wait_total_ms / self.wait_count, 3) if self.wait_count else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "wait_histogram": histograma,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+            }
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool que mide cuánto espera cada checkout."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        overflow_antes = self.overflow()
+        inicio = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.observe_timeout()
+            raise
+        self.metrics.observe_wait((time.perf_counter() - inicio) * 1000)
+        if self.overflow() > overflow_antes and self.overflow() > 0:
+            self.metrics.observe_overflow()
+        return conn
+
+    def recreate(self):
+        nuevo = super().recreate()
+        nuevo.metrics = self.metrics
+        return nuevo
+
+def pool_status(pool) -> Dict:
+    """Estado en vivo del pool más las métricas acumuladas."""
+    if isinstance(pool, NullPool):
+        return {"pool": "NullPool", "status": pool.status()}
+    estado = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        estado.update(metrics.snapshot())
+    return estado
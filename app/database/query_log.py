@@ -0,0 +1,111 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+from contextvars import ContextVar
+from hashlib import sha1
+from typing import Optional
+
+from sqlalchemy import event
+
+# Ruta HTTP que está ejecutando la consulta; la fija el middleware de main.py.
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+query_logger = logging.getLogger("app.sql")
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"(?:\$\d+|%\(\w+\)s|:\w+|\?)")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+# ---------------------- FINGERPRINT ----------------------
+def normalize_statement(statement: str) -> str:
+    """Reemplaza literales y parámetros por '?' para agrupar consultas iguales."""
+    sql = _STRING_RE.sub("?", statement)
+    sql = _PARAM_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("(?)", sql)
+    return _SPACE_RE.sub(" ", sql).strip()
+
+def fingerprint(statement: str) -> str:
+    return sha1(normalize_statement(statement).encode()).hexdigest()[:16]
+
+# ---------------------- CONFIG ----------------------
+def _sample_rate() -> float:
+    return float(os.getenv("DB_QUERY_LOG_SAMPLE_RATE", "0.01"))
+
+def _slow_threshold_ms() -> float:
+    return float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+
+def _file_handler_async(path: str) -> logging.Handler:
+    """Escribe en archivo desde un hilo aparte para no bloquear el event loop."""
+    cola: queue.Queue = queue.Queue(-1)
+    file_handler = logging.FileHandler(path, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(cola, file_handler)
+    listener.start()
+    return logging.handlers.QueueHandler(cola)
+
+def _configure_loggers():
+    # Sin nivel propio, app.sql heredaría WARNING del root y descartaría el log
+    # muestreado; un nivel fijado por la configuración de logging se respeta.
+    if query_logger.level == logging.NOTSET:
+        query_logger.setLevel(logging.INFO)
+    query_log_file = os.getenv("DB_QUERY_LOG_FILE")
+    if query_log_file and not query_logger.handlers:
+        query_logger.addHandler(_file_handler_async(query_log_file))
+    slow_log_file = os.getenv("DB_SLOW_QUERY_LOG_FILE")
+    if slow_log_file and not slow_query_logger.handlers:
+        slow_query_logger.addHandler(_file_handler_async(slow_log_file))
+        slow_query_logger.propagate = False
+
+# ---------------------- EVENTS ----------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_log_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_log_start")
+    if not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1000
+    slow = duration_ms >= _slow_threshold_ms()
+    sampled = random.random() < _sample_rate()
+    if not (slow or sampled):
+        return
+
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount is None or rowcount < 0:
+        rows = getattr(cursor, "_rows", None)
+        rowcount = len(rows) if rows is not None else None
+    registro = {
+        "fingerprint": fingerprint(statement),
+        "statement": normalize_statement(statement),
+        "duration_ms": round(duration_ms, 3),
+        "rows": rowcount,
+        "executemany": executemany,
+        "route": current_route.get(),
+    }
+    mensaje = json.dumps(registro, ensure_ascii=False)
+    if sampled:
+        query_logger.info(mensaje)
+    if slow:
+        slow_query_logger.warning(mensaje)
+
+def _handle_error(context):
+    conn = context.connection
+    if conn is not None and conn.info.get("query_log_start"):
+        conn.info["query_log_start"].pop()
+
+def install_query_log(engine):
+    """Registra los eventos del log estructurado sobre un engine (sync o async)."""
+    _configure_loggers()
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
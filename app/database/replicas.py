@@ -0,0 +1,97 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+
+# Cookie con la marca de tiempo hasta la que el cliente debe leer del primario.
+READ_YOUR_WRITES_COOKIE = "rw_until"
+
+class Replica:
+    """Engine de solo lectura con su estado de salud."""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.unhealthy_until = 0.0
+
+    def available(self) -> bool:
+        return self.healthy or time.monotonic() >= self.unhealthy_until
+
+    def mark_failed(self, error: Exception, retry_seconds: float):
+        if self.healthy:
+            logging.warning(f"Réplica {self.name} marcada como no disponible: {error}")
+        self.healthy = False
+        self.last_error = str(error)
+        self.unhealthy_until = time.monotonic() + retry_seconds
+
+    def mark_healthy(self):
+        if not self.healthy:
+            logging.info(f"Réplica {self.name} disponible de nuevo.")
+        self.healthy = True
+        self.last_error = None
+
+class ReplicaRouter:
+    """Reparte las lecturas entre réplicas sanas con caída al primario."""
+
+    def __init__(self, replicas: List[Replica], retry_seconds: float = 30.0, check_timeout: float = 2.0):
+        self.replicas = replicas
+        self.retry_seconds = retry_seconds
+        self.check_timeout = check_timeout
+        self._cycle = itertools.cycle(replicas) if replicas else None
+
+    def choose(self) -> Optional[Replica]:
+        """Siguiente réplica disponible en round-robin, o None para usar el primario."""
+        if not self._cycle:
+            return None
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.available():
+                return replica
+        return None
+
+    async def check(self, replica: Replica) -> bool:
+        replica.last_check = time.time()
+        try:
+            async with replica.engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), self.check_timeout)
+        except Exception as e:
+            replica.mark_failed(e, self.retry_seconds)
+            return False
+        replica.mark_healthy()
+        return True
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(r) for r in self.replicas))
+
+    async def run_health_checks(self, interval: float):
+        """Bucle de fondo que verifica las réplicas cada `interval` segundos."""
+        while True:
+            await self.check_all()
+            await asyncio.sleep(interval)
+
+    def status(self) -> List[dict]:
+        return [
+            {
+                "name": r.name,
+                "healthy": r.healthy,
+                "last_check": r.last_check,
+                "last_error": r.last_error,
+            }
+            for r in self.replicas
+        ]
+
+def must_read_primary(cookies: dict, now: Optional[float] = None) -> bool:
+    """True si el cliente escribió hace poco y debe ver sus propios cambios."""
+    valor = cookies.get(READ_YOUR_WRITES_COOKIE)
+    if not valor:
+        return False
+    try:
+        return float(valor) > (now if now is not None else time.time())
+    except ValueError:
+        return False
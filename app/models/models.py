@@ -1,6 +1,18 @@
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Index, ForeignKey, Table, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship
 from app.database.db import Base
 
+# Asociación N:M ruta–estación. La PK cubre las búsquedas por ruta y el
+# índice secundario las búsquedas por estación.
+ruta_estacion = Table(
+    "ruta_estacion",
+    Base.metadata,
+    Column("ruta_id", Integer, ForeignKey("rutas.id", ondelete="CASCADE"), primary_key=True),
+    Column("estacion_id", Integer, ForeignKey("estaciones.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_ruta_estacion_estacion", "estacion_id", "ruta_id"),
+)
+
 class Ruta(Base):
     __tablename__ = "rutas"
     id = Column(Integer, primary_key=True, index=True)
@@ -9,19 +21,93 @@ class Ruta(Base):
     horario = Column(String)
     activo = Column(Boolean, default=True)
 
+    estaciones = relationship(
+        "Estacion", secondary=ruta_estacion, back_populates="rutas", passive_deletes=True, lazy="raise"
+    )
+
 class Bus(Base):
     __tablename__ = "buses"
     id = Column(Integer, primary_key=True, index=True)
     nombre_bus = Column(String, index=True)
+    nombre_bus_norm = Column(String, nullable=True)
     tipo = Column(String)  
     activo = Column(Boolean, default=True)
     imagen = Column(String, nullable=True)  
+    imagen_variantes = Column(JSONB, nullable=True)
+
+    __table_args__ = (
+        Index("ix_buses_tipo_activo", "tipo", "activo"),
+        Index("ix_buses_activos", "tipo", "id", postgresql_where=text("activo")),
+    )
 
 class Estacion(Base):
     __tablename__ = "estaciones"
     id = Column(Integer, primary_key=True, index=True)
     nombre_estacion = Column(String, unique=True, index=True)
+    nombre_estacion_norm = Column(String, nullable=True)
     localidad = Column(String)  
+    localidad_norm = Column(String, nullable=True)
     rutas_asociadas = Column(String)
     activo = Column(Boolean, default=True)
-    imagen = Column(String, nullable=True)  
\ No newline at end of file
+    imagen = Column(String, nullable=True)
+    imagen_variantes = Column(JSONB, nullable=True)
+
+    rutas = relationship(
+        "Ruta", secondary=ruta_estacion, back_populates="estaciones", passive_deletes=True, lazy="raise"
+    )
+
+    # Las columnas *_norm (sin tildes, minúsculas) se buscan con LIKE '%x%';
+    # sus índices trigram necesitan pg_trgm y se crean en las migraciones
+    # de app/database/migrations.py.
+    __table_args__ = (
+        Index("ix_estaciones_activas", "id", postgresql_where=text("activo")),
+    )
+
+class HistorialEliminacion(Base):
+    """Registro de cada bus o estación eliminada; se escribe en la misma
+    transacción que el DELETE y se poda por antigüedad (ver app/operations/historial.py)."""
+    __tablename__ = "historial_eliminados"
+    id = Column(BigInteger, primary_key=True)
+    tipo = Column(String, nullable=False)
+    registro_id = Column(Integer, nullable=False)
+    nombre_bus = Column(String, nullable=True)
+    tipo_bus = Column(String, nullable=True)
+    nombre_estacion = Column(String, nullable=True)
+    localidad = Column(String, nullable=True)
+    fecha_hora = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_historial_fecha_hora", "fecha_hora"),
+        Index("ix_historial_tipo_id", "tipo", "id"),
+    )
+
+class Job(Base):
+    """Trabajo en segundo plano (p. ej. borrar imágenes); lo procesan los
+    workers de app/services/jobs.py con FOR UPDATE SKIP LOCKED."""
+    __tablename__ = "jobs"
+    id = Column(BigInteger, primary_key=True)
+    tipo = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'"))
+    estado = Column(String, nullable=False, server_default="pendiente")
+    intentos = Column(Integer, nullable=False, server_default="0")
+    max_intentos = Column(Integer, nullable=False, server_default="5")
+    disponible_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    bloqueado_en = Column(DateTime(timezone=True), nullable=True)
+    ultimo_error = Column(String, nullable=True)
+    creado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_jobs_pendientes", "disponible_en", postgresql_where=text("estado = 'pendiente'")),
+        Index("ix_jobs_en_proceso", "bloqueado_en", postgresql_where=text("estado = 'en_proceso'")),
+    )
+
+class Imagen(Base):
+    """Imagen guardada por contenido (sha256) en un bucket y cuántas filas la usan;
+    cuando `referencias` llega a 0 se borra del storage (ver app/operations/imagenes.py)."""
+    __tablename__ = "imagenes"
+    bucket = Column(String, primary_key=True)
+    sha256 = Column(String, primary_key=True)
+    clave = Column(String, nullable=False, unique=True)
+    variantes = Column(JSONB, nullable=True)
+    referencias = Column(Integer, nullable=False, server_default="0")
+    creado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
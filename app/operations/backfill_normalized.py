@@ -0,0 +1,89 @@
+"""Rellena las columnas *_norm de buses y estaciones por lotes.
+
+Uso:
+    python -m app.operations.backfill_normalized [--batch-size 1000] [--all]
+
+Recorre cada tabla por id (keyset) y confirma cada lote por separado, así
+que se puede interrumpir y reanudar sin bloquear la tabla entera. Por
+defecto solo procesa filas con alguna columna normalizada en NULL; `--all`
+recalcula todas.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.future import select
+
+from app.database.db import new_session, dispose_engines
+from app.models.models import Bus, Estacion
+from app.operations.crud import normalize_string
+
+def _norm(valor):
+    return normalize_string(valor) if valor is not None else None
+
+async def backfill_buses(batch_size: int, todas: bool) -> int:
+    total, ultimo_id = 0, 0
+    while True:
+        async with new_session() as session:
+            query = select(Bus.id, Bus.nombre_bus).where(Bus.id > ultimo_id).order_by(Bus.id).limit(batch_size)
+            if not todas:
+                query = query.where(Bus.nombre_bus_norm.is_(None))
+            filas = (await session.execute(query)).all()
+            if not filas:
+                return total
+            await session.execute(
+                update(Bus.__table__).where(Bus.__table__.c.id == bindparam("b_id")).values(
+                    nombre_bus_norm=bindparam("b_nombre")
+                ),
+                [{"b_id": f.id, "b_nombre": _norm(f.nombre_bus)} for f in filas],
+            )
+            await session.commit()
+        total += len(filas)
+        ultimo_id = filas[-1].id
+        print(f"buses: {total} filas normalizadas (hasta id {ultimo_id})")
+
+async def backfill_estaciones(batch_size: int, todas: bool) -> int:
+    total, ultimo_id = 0, 0
+    while True:
+        async with new_session() as session:
+            query = (
+                select(Estacion.id, Estacion.nombre_estacion, Estacion.localidad)
+                .where(Estacion.id > ultimo_id)
+                .order_by(Estacion.id)
+                .limit(batch_size)
+            )
+            if not todas:
+                query = query.where(or_(Estacion.nombre_estacion_norm.is_(None), Estacion.localidad_norm.is_(None)))
+            filas = (await session.execute(query)).all()
+            if not filas:
+                return total
+            tabla = Estacion.__table__
+            await session.execute(
+                update(tabla).where(tabla.c.id == bindparam("e_id")).values(
+                    nombre_estacion_norm=bindparam("e_nombre"),
+                    localidad_norm=bindparam("e_localidad"),
+                ),
+                [
+                    {"e_id": f.id, "e_nombre": _norm(f.nombre_estacion), "e_localidad": _norm(f.localidad)}
+                    for f in filas
+                ],
+            )
+            await session.commit()
+        total += len(filas)
+        ultimo_id = filas[-1].id
+        print(f"estaciones: {total} filas normalizadas (hasta id {ultimo_id})")
+
+async def main(batch_size: int, todas: bool):
+    try:
+        buses = await backfill_buses(batch_size, todas)
+        estaciones = await backfill_estaciones(batch_size, todas)
+        print(f"Listo: {buses} buses y {estaciones} estaciones.")
+    finally:
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--all", action="store_true", dest="todas")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.todas))
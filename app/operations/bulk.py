@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+import os
+from typing import List, Tuple, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+# Máximo de filas por petición de carga masiva.
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "5000"))
+
+def parse_bulk_body(content_type: str, body: bytes) -> List[dict]:
+    """Convierte un arreglo JSON, NDJSON o CSV (con encabezado) en una lista de dicts."""
+    tipo = (content_type or "application/json").split(";")[0].strip().lower()
+    try:
+        texto = body.decode("utf-8-sig")
+        if tipo in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            filas = [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+        elif tipo in ("text/csv", "application/csv"):
+            filas = [
+                {k: (v if v != "" else None) for k, v in fila.items()}
+                for fila in csv.DictReader(io.StringIO(texto))
+            ]
+        elif tipo == "application/json":
+            filas = json.loads(texto)
+            if not isinstance(filas, list):
+                raise ValueError("se esperaba un arreglo JSON")
+        else:
+            raise HTTPException(status_code=415, detail=f"Tipo de contenido no soportado: {tipo}")
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo inválido: {e}")
+    if len(filas) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ROWS} filas por petición")
+    return filas
+
+def unique_ids(ids: List[int]) -> List[int]:
+    """Ids sin repetir, en el orden recibido, con el mismo tope que la carga masiva."""
+    unicos = list(dict.fromkeys(ids))
+    if len(unicos) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ROWS} ids por petición")
+    return unicos
+
+def validate_rows(filas: List[dict], schema: Type[BaseModel]) -> Tuple[List[Tuple[int, BaseModel]], List[dict]]:
+    """Separa filas válidas (índice, modelo) de las inválidas (resultado con error)."""
+    validas, invalidas = [], []
+    for i, fila in enumerate(filas):
+        try:
+            if not isinstance(fila, dict):
+                raise ValueError("cada fila debe ser un objeto")
+            validas.append((i, schema.model_validate(fila)))
+        except (ValidationError, ValueError) as e:
+            invalidas.append({"fila": i, "estado": "invalido", "error": str(e)})
+    return validas, invalidas
@@ -1,113 +1,252 @@
 import logging
+import re
 import unicodedata
-from typing import Optional, List
+from typing import Dict, Optional, List, AsyncIterator
 from fastapi import HTTPException, UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession 
 from sqlalchemy.future import select 
-from sqlalchemy import func
-from app.models.models import Bus, Estacion
-from app.services.supabase_client import supabase, save_file
+from sqlalchemy import bindparam, delete, insert, update, text, Integer
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.orm import selectinload
+from app.models.models import Bus, Estacion, Ruta, ruta_estacion
+from app.schemas.schemas import BusCreate, EstacionCreate, BusResponse, EstacionResponse
+from app.operations.query_cache import statement_cache
+from app.services.supabase_client import save_file
+from app.services.storage import BUCKET_BUSES, BUCKET_ESTACIONES, key_from_url
+from app.operations.imagenes import liberar_imagenes, registrar_imagen, retener_imagenes
 
 # ---------------------- CONST ----------------------
-SUPABASE_BUCKET = "buses"
+BUSES_QUERIES = statement_cache("obtener_buses")
+ESTACIONES_QUERIES = statement_cache("obtener_estaciones")
 
-# ---------------------- UTILS ----------------------
-def get_supabase_path_from_url(url: str, bucket_name: str) -> str:
-    parts = url.split(f"/public/{bucket_name}/")
-    if len(parts) > 1:
-        return parts[-1]
-    return ""
+# Columnas que devuelven las escrituras con RETURNING (las de BusResponse/EstacionResponse).
+BUS_RETURNING = tuple(Bus.__table__.c[c] for c in BusResponse.model_fields)
+ESTACION_RETURNING = tuple(Estacion.__table__.c[c] for c in EstacionResponse.model_fields)
 
+# ---------------------- UTILS ----------------------
 def normalize_string(s: str) -> str:
     return ''.join(c for c in unicodedata.normalize('NFD', s.lower()) if unicodedata.category(c) != 'Mn').strip()
 
+def _normalize_optional(s: Optional[str]) -> Optional[str]:
+    return normalize_string(s) if s is not None else None
+
+def contains_pattern(s: str) -> str:
+    """Patrón LIKE '%texto%' sobre el texto normalizado, escapando comodines."""
+    texto = normalize_string(s).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{texto}%"
+
+# Solo separadores explícitos: los nombres de ruta pueden llevar espacios ("Portal Norte").
+_RUTAS_SEP = re.compile(r"[,;|]")
+
+def parse_rutas(rutas_asociadas: Optional[str]) -> List[str]:
+    """'B74, k86; Portal  Norte; B74' -> ['B74', 'K86', 'PORTAL NORTE'] (sin duplicados, en orden)."""
+    if not rutas_asociadas:
+        return []
+    vistas = {}
+    for parte in _RUTAS_SEP.split(rutas_asociadas.upper()):
+        nombre = " ".join(parte.split())
+        if nombre:
+            vistas.setdefault(nombre, None)
+    return list(vistas)
+
+def sync_bus_normalized(bus: Bus) -> None:
+    """Actualiza las columnas de búsqueda normalizadas (sin tildes, minúsculas)."""
+    bus.nombre_bus_norm = _normalize_optional(bus.nombre_bus)
+
+def sync_estacion_normalized(estacion: Estacion) -> None:
+    estacion.nombre_estacion_norm = _normalize_optional(estacion.nombre_estacion)
+    estacion.localidad_norm = _normalize_optional(estacion.localidad)
+
 # ---------------------- BUS CRUD ----------------------
+def _build_buses_query(signature: tuple):
+    query = select(Bus)
+    if "bus_id" in signature:
+        query = query.where(Bus.id == bindparam("bus_id"))
+    if "tipo" in signature:
+        query = query.where(Bus.tipo == bindparam("tipo"))
+    if "activo" in signature:
+        query = query.where(Bus.activo == bindparam("activo"))
+    if "nombre" in signature:
+        query = query.where(Bus.nombre_bus_norm.like(bindparam("nombre")))
+    if "after_id" in signature:
+        query = query.where(Bus.id > bindparam("after_id"))
+    query = query.order_by(Bus.id)
+    if "limit" in signature:
+        query = query.limit(bindparam("limit", type_=Integer))
+    return query
+
+def _buses_params(bus_id=None, tipo=None, activo=None, nombre=None, after_id=None, limit=None) -> dict:
+    params = {
+        k: v for k, v in (("bus_id", bus_id), ("tipo", tipo), ("activo", activo))
+        if v is not None
+    }
+    if nombre is not None:
+        params["nombre"] = contains_pattern(nombre)
+    if after_id is not None:
+        params["after_id"] = after_id
+    if limit is not None:
+        params["limit"] = limit
+    return params
+
 async def obtener_buses(
     session: AsyncSession, 
     bus_id: Optional[int] = None,
     tipo: Optional[str] = None,
-    activo: Optional[bool] = None
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None
 ) -> List[Bus]:
-    query = select(Bus)
-    if bus_id is not None:
-        query = query.where(Bus.id == bus_id)
-    if tipo is not None:
-        query = query.where(Bus.tipo == tipo)
-    if activo is not None:
-        query = query.where(Bus.activo == activo)
-
-    result = await session.execute(query)
+    """Buses ordenados por id; `after_id`/`limit` permiten paginar por keyset."""
+    params = _buses_params(bus_id, tipo, activo, nombre, after_id, limit)
+    query = BUSES_QUERIES.get(tuple(params), _build_buses_query)
+    result = await session.execute(query, params)
     return result.scalars().all()
 
+async def stream_buses(
+    session: AsyncSession,
+    bus_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    batch_size: int = 500
+) -> AsyncIterator[List[Bus]]:
+    """Lotes de buses leídos con un cursor del lado del servidor."""
+    params = _buses_params(bus_id, tipo, activo, nombre)
+    query = BUSES_QUERIES.get(tuple(params), _build_buses_query)
+    result = await session.stream(query, params, execution_options={"yield_per": batch_size})
+    async for lote in result.scalars().partitions(batch_size):
+        yield lote
+
 async def crear_bus(
     session: AsyncSession,
     nombre_bus: str,
     tipo: str,
     activo: bool,
     imagen: Optional[UploadFile] = None
-) -> Optional[Bus]:
+) -> Optional[BusResponse]:
+    """Inserta el bus con INSERT ... RETURNING: una sola ida a la base más el COMMIT."""
     try:
-        new_bus = Bus(
-            nombre_bus=nombre_bus,
-            tipo=tipo,
-            activo=activo,
-            imagen=None
-        )
+        valores = {
+            "nombre_bus": nombre_bus,
+            "nombre_bus_norm": _normalize_optional(nombre_bus),
+            "tipo": tipo,
+            "activo": activo,
+            "imagen": None,
+        }
 
+        subida = {}
         if imagen:
-            result = await save_file(imagen, to_supabase=True, bucket_name=SUPABASE_BUCKET)
-            if "url" in result:
-                new_bus.imagen = result["url"]
+            subida = await save_file(imagen, bucket_name=BUCKET_BUSES, session=session)
+            if "key" in subida:
+                valores["imagen"] = subida["key"]
+                valores["imagen_variantes"] = subida.get("variantes")
             else:
-                logging.error(f"Error al subir imagen para bus: {result.get('error', 'Unknown error')}")
+                logging.error(f"Error al subir imagen para bus: {subida.get('error', 'Unknown error')}")
+                if "status_code" in subida:
+                    raise HTTPException(status_code=subida["status_code"], detail=subida["error"])
                 return None
 
-        session.add(new_bus)
+        result = await session.execute(insert(Bus.__table__).values(**valores).returning(*BUS_RETURNING))
+        new_bus = BusResponse.model_validate(result.one())
+        await registrar_imagen(session, subida)
         await session.commit()
-        await session.refresh(new_bus)
         return new_bus
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error creando bus en la base de datos: {e}")
         await session.rollback() 
         return None
 
-async def eliminar_bus(session: AsyncSession, bus_id: int) -> bool: 
-    bus = await session.execute(select(Bus).where(Bus.id == bus_id))
-    bus_to_delete = bus.scalar_one_or_none()
-    if bus_to_delete:
-        if bus_to_delete.imagen:
-            try:
-                path_to_delete = get_supabase_path_from_url(bus_to_delete.imagen, SUPABASE_BUCKET)
-                if path_to_delete:
-                    supabase.storage.from_(SUPABASE_BUCKET).remove([path_to_delete])
-                    logging.info(f"Imagen {path_to_delete} eliminada de Supabase.")
-            except Exception as e:
-                logging.error(f"Error al eliminar imagen de Supabase para bus {bus_id}: {e}")
-
-        await session.delete(bus_to_delete)
-        await session.commit()
-        return True
-    return False
+# Los ids se toman de la secuencia en el CTE, fila por fila de entrada, así
+# que cada posición (ord) queda emparejada con su id sin depender del orden
+# en que Postgres devuelva el RETURNING.
+_CREAR_BUSES_SQL = text(
+    "WITH datos AS ("
+    " SELECT nextval(pg_get_serial_sequence('buses', 'id')) AS id, t.*"
+    " FROM unnest(CAST(:nombres AS VARCHAR[]), CAST(:normas AS VARCHAR[]), CAST(:tipos AS VARCHAR[]),"
+    " CAST(:activos AS BOOLEAN[]), CAST(:imagenes AS VARCHAR[]))"
+    " WITH ORDINALITY AS t (nombre_bus, nombre_bus_norm, tipo, activo, imagen, ord)), "
+    "insertados AS ("
+    " INSERT INTO buses (id, nombre_bus, nombre_bus_norm, tipo, activo, imagen)"
+    " SELECT id, nombre_bus, nombre_bus_norm, tipo, activo, imagen FROM datos ORDER BY ord"
+    " RETURNING id) "
+    "SELECT d.ord, d.id FROM datos d JOIN insertados i ON i.id = d.id ORDER BY d.ord"
+)
 
-async def actualizar_estado_bus(session: AsyncSession, bus_id: int, nuevo_estado: bool) -> Optional[Bus]: 
-    result = await session.execute(select(Bus).where(Bus.id == bus_id))
-    bus = result.scalar_one_or_none()
-    if not bus:
-        return None
-    bus.activo = nuevo_estado
+async def crear_buses_lote(session: AsyncSession, buses: List[BusCreate], chunk_size: int = 1000) -> List[int]:
+    """Inserta buses con un INSERT ... SELECT FROM unnest(...) WITH ORDINALITY por lote, sin confirmar.
+
+    Devuelve los ids en el mismo orden de `buses`.
+    """
+    ids: List[int] = []
+    for inicio in range(0, len(buses), chunk_size):
+        lote = buses[inicio:inicio + chunk_size]
+        imagenes = [key_from_url(b.imagen) or b.imagen for b in lote]
+        result = await session.execute(_CREAR_BUSES_SQL, {
+            "nombres": [b.nombre_bus for b in lote],
+            "normas": [_normalize_optional(b.nombre_bus) for b in lote],
+            "tipos": [b.tipo for b in lote],
+            "activos": [b.activo for b in lote],
+            "imagenes": imagenes,
+        })
+        por_orden = {fila.ord: fila.id for fila in result}
+        ids.extend(por_orden[i] for i in range(1, len(lote) + 1))
+        await retener_imagenes(session, imagenes)
+    return ids
+
+# Borra y registra en el historial en una sola sentencia (misma transacción).
+_ELIMINAR_BUSES_SQL = text(
+    "WITH borrados AS ("
+    " DELETE FROM buses WHERE id = ANY(CAST(:ids AS INTEGER[]))"
+    " RETURNING id, nombre_bus, tipo, imagen, imagen_variantes), "
+    "historial AS ("
+    " INSERT INTO historial_eliminados (tipo, registro_id, nombre_bus, tipo_bus)"
+    " SELECT 'bus', id, nombre_bus, tipo FROM borrados) "
+    "SELECT id, nombre_bus, tipo, imagen, imagen_variantes FROM borrados"
+).columns(imagen_variantes=JSONB)
+
+async def eliminar_buses_lote(session: AsyncSession, ids: List[int]) -> list:
+    """DELETE ... WHERE id = ANY(:ids) RETURNING y COMMIT; devuelve las filas borradas.
+
+    El historial se escribe en la misma sentencia y, en la misma
+    transacción, se descuentan las referencias de las imágenes y se encola
+    el borrado de las que quedan sin uso; un worker lo ejecuta después.
+    """
+    if not ids:
+        return []
+    result = await session.execute(_ELIMINAR_BUSES_SQL, {"ids": list(ids)})
+    eliminados = result.all()
+    await liberar_imagenes(session, [(b.imagen, b.imagen_variantes) for b in eliminados])
     await session.commit()
-    await session.refresh(bus)
-    return bus
+    return eliminados
 
-async def actualizar_imagen_bus(session: AsyncSession, bus_id: int, imagen_url: str) -> Optional[Bus]: 
-    result = await session.execute(select(Bus).where(Bus.id == bus_id))
-    bus = result.scalar_one_or_none()
-    if not bus:
-        return None
-    bus.imagen = imagen_url
+async def eliminar_bus(session: AsyncSession, bus_id: int):
+    """Devuelve la fila borrada (id, nombre_bus, tipo, imagen) o None si no existía."""
+    eliminados = await eliminar_buses_lote(session, [bus_id])
+    return eliminados[0] if eliminados else None
+
+async def actualizar_bus(session: AsyncSession, bus_id: int, subida: Optional[Dict] = None, **valores) -> Optional[BusResponse]:
+    """UPDATE ... RETURNING y COMMIT; None si el bus no existe.
+
+    `subida` es el resultado de `save_file` si también cambia la imagen (ver `_actualizar_fila`).
+    """
+    if "nombre_bus" in valores:
+        valores["nombre_bus_norm"] = _normalize_optional(valores["nombre_bus"])
+    fila = await _actualizar_fila(session, Bus.__table__, bus_id, valores, BUS_RETURNING, subida)
     await session.commit()
-    await session.refresh(bus)
-    return bus
+    return BusResponse.model_validate(fila) if fila else None
+
+async def actualizar_estado_bus(session: AsyncSession, bus_id: int, nuevo_estado: bool) -> Optional[BusResponse]: 
+    return await actualizar_bus(session, bus_id, activo=nuevo_estado)
+
+async def actualizar_imagen_bus(
+    session: AsyncSession, bus_id: int, clave: str, variantes: Optional[Dict] = None
+) -> Optional[BusResponse]:
+    """Cambia la imagen del bus por `clave` (ya guardada en el storage) y COMMIT; None si no existe."""
+    fila = await _cambiar_imagen(session, Bus.__table__, bus_id, clave, variantes, BUS_RETURNING)
+    return BusResponse.model_validate(fila) if fila else None
 
 async def get_all_bus_ids(session: AsyncSession) -> List[int]: 
     result = await session.execute(select(Bus.id))
@@ -115,24 +254,69 @@ async def get_all_bus_ids(session: AsyncSession) -> List[int]:
 
 
 # ---------------------- ESTACION CRUD ----------------------
-async def obtener_estaciones(
-    session: AsyncSession, 
-    estacion_id: Optional[int] = None,
-    localidad: Optional[str] = None,
-    activo: Optional[bool] = None
-) -> List[Estacion]:
+def _build_estaciones_query(signature: tuple):
     query = select(Estacion)
+    if "estacion_id" in signature:
+        query = query.where(Estacion.id == bindparam("estacion_id"))
+    if "localidad" in signature:
+        query = query.where(Estacion.localidad_norm.like(bindparam("localidad")))
+    if "activo" in signature:
+        query = query.where(Estacion.activo == bindparam("activo"))
+    if "nombre" in signature:
+        query = query.where(Estacion.nombre_estacion_norm.like(bindparam("nombre")))
+    if "after_id" in signature:
+        query = query.where(Estacion.id > bindparam("after_id"))
+    query = query.order_by(Estacion.id)
+    if "limit" in signature:
+        query = query.limit(bindparam("limit", type_=Integer))
+    return query
+
+def _estaciones_params(estacion_id=None, localidad=None, activo=None, nombre=None, after_id=None, limit=None) -> dict:
+    params = {}
     if estacion_id is not None:
-        query = query.where(Estacion.id == estacion_id)
+        params["estacion_id"] = estacion_id
     if localidad is not None:
-        like_pattern = f"%{localidad.lower()}%"
-        query = query.where(func.lower(Estacion.localidad).like(like_pattern))
+        params["localidad"] = contains_pattern(localidad)
     if activo is not None:
-        query = query.where(Estacion.activo == activo)
+        params["activo"] = activo
+    if nombre is not None:
+        params["nombre"] = contains_pattern(nombre)
+    if after_id is not None:
+        params["after_id"] = after_id
+    if limit is not None:
+        params["limit"] = limit
+    return params
 
-    result = await session.execute(query)
+async def obtener_estaciones(
+    session: AsyncSession, 
+    estacion_id: Optional[int] = None,
+    localidad: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[Estacion]:
+    """Estaciones ordenadas por id; `after_id`/`limit` permiten paginar por keyset."""
+    params = _estaciones_params(estacion_id, localidad, activo, nombre, after_id, limit)
+    query = ESTACIONES_QUERIES.get(tuple(params), _build_estaciones_query)
+    result = await session.execute(query, params)
     return result.scalars().all()
 
+async def stream_estaciones(
+    session: AsyncSession,
+    estacion_id: Optional[int] = None,
+    localidad: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    batch_size: int = 500
+) -> AsyncIterator[List[Estacion]]:
+    """Lotes de estaciones leídos con un cursor del lado del servidor."""
+    params = _estaciones_params(estacion_id, localidad, activo, nombre)
+    query = ESTACIONES_QUERIES.get(tuple(params), _build_estaciones_query)
+    result = await session.stream(query, params, execution_options={"yield_per": batch_size})
+    async for lote in result.scalars().partitions(batch_size):
+        yield lote
+
 async def crear_estacion(
     session: AsyncSession, 
     nombre_estacion: str,
@@ -140,71 +324,274 @@ async def crear_estacion(
     rutas_asociadas: str,
     activo: bool,
     imagen: Optional[UploadFile] = None
-) -> Optional[Estacion]:
+) -> Optional[EstacionResponse]:
+    """Inserta la estación con INSERT ... RETURNING y enlaza sus rutas en la misma transacción."""
     try:
-        nueva_estacion = Estacion(
-            nombre_estacion=nombre_estacion,
-            localidad=localidad,
-            rutas_asociadas=rutas_asociadas,
-            activo=activo,
-            imagen=None
-        )
+        valores = {
+            "nombre_estacion": nombre_estacion,
+            "nombre_estacion_norm": _normalize_optional(nombre_estacion),
+            "localidad": localidad,
+            "localidad_norm": _normalize_optional(localidad),
+            "rutas_asociadas": rutas_asociadas,
+            "activo": activo,
+            "imagen": None,
+        }
 
+        subida = {}
         if imagen:
-            result = await save_file(imagen, to_supabase=True, bucket_name=SUPABASE_BUCKET)
-            if "url" in result:
-                nueva_estacion.imagen = result["url"]
+            subida = await save_file(imagen, bucket_name=BUCKET_ESTACIONES, session=session)
+            if "key" in subida:
+                valores["imagen"] = subida["key"]
+                valores["imagen_variantes"] = subida.get("variantes")
             else:
-                logging.error(f"Error al subir imagen para estación: {result.get('error', 'Unknown error')}")
+                logging.error(f"Error al subir imagen para estación: {subida.get('error', 'Unknown error')}")
+                if "status_code" in subida:
+                    raise HTTPException(status_code=subida["status_code"], detail=subida["error"])
                 return None
 
-        session.add(nueva_estacion)
+        result = await session.execute(
+            insert(Estacion.__table__).values(**valores).returning(*ESTACION_RETURNING)
+        )
+        nueva_estacion = EstacionResponse.model_validate(result.one())
+        await registrar_imagen(session, subida)
+        # Estación nueva: no hay enlaces previos que borrar.
+        await asociar_rutas(session, [(nueva_estacion.id, r) for r in parse_rutas(rutas_asociadas)])
         await session.commit()
-        await session.refresh(nueva_estacion)
         return nueva_estacion
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error creando estación en la base de datos: {e}")
         await session.rollback() 
         return None
 
-async def eliminar_estacion(session: AsyncSession, estacion_id: int) -> bool: 
-    estacion = await session.execute(select(Estacion).where(Estacion.id == estacion_id))
-    estacion_to_delete = estacion.scalar_one_or_none()
-    if estacion_to_delete:
-        if estacion_to_delete.imagen:
-            try:
-                path_to_delete = get_supabase_path_from_url(estacion_to_delete.imagen, SUPABASE_BUCKET)
-                if path_to_delete:
-                    supabase.storage.from_(SUPABASE_BUCKET).remove([path_to_delete])
-                    logging.info(f"Imagen {path_to_delete} eliminada de Supabase.")
-            except Exception as e:
-                logging.error(f"Error al eliminar imagen de Supabase para estación {estacion_id}: {e}")
-
-        await session.delete(estacion_to_delete)
-        await session.commit()
-        return True
-    return False
+async def crear_estaciones_lote(session: AsyncSession, estaciones: List[EstacionCreate], chunk_size: int = 1000) -> dict:
+    """Inserta estaciones con ON CONFLICT (nombre_estacion) DO NOTHING RETURNING, sin confirmar.
 
-async def actualizar_estado_estacion(session: AsyncSession, estacion_id: int, nuevo_estado: bool) -> Optional[Estacion]: 
-    result = await session.execute(select(Estacion).where(Estacion.id == estacion_id))
-    estacion = result.scalar_one_or_none()
-    if not estacion:
-        return None
-    estacion.activo = nuevo_estado
+    Devuelve {nombre_estacion: id} solo para las filas insertadas; los nombres
+    repetidos (en la base o dentro del mismo lote, donde gana la primera
+    aparición) quedan fuera sin abortar el resto. Las imágenes y las rutas se
+    enlazan solo para las estaciones que devolvió el RETURNING.
+    """
+    unicas = {}
+    for e in estaciones:
+        unicas.setdefault(e.nombre_estacion, e)
+    estaciones = list(unicas.values())
+    creadas = {}
+    tabla = Estacion.__table__
+    for inicio in range(0, len(estaciones), chunk_size):
+        lote = estaciones[inicio:inicio + chunk_size]
+        valores = [
+            {
+                "nombre_estacion": e.nombre_estacion,
+                "nombre_estacion_norm": _normalize_optional(e.nombre_estacion),
+                "localidad": e.localidad,
+                "localidad_norm": _normalize_optional(e.localidad),
+                "rutas_asociadas": e.rutas_asociadas,
+                "activo": e.activo,
+                "imagen": key_from_url(e.imagen) or e.imagen,
+            }
+            for e in lote
+        ]
+        result = await session.execute(
+            pg_insert(tabla)
+            .values(valores)
+            .on_conflict_do_nothing(index_elements=["nombre_estacion"])
+            .returning(tabla.c.id, tabla.c.nombre_estacion)
+        )
+        nuevas = {fila.nombre_estacion: fila.id for fila in result}
+        creadas.update(nuevas)
+        insertadas = [(v, e) for v, e in zip(valores, lote) if v["nombre_estacion"] in nuevas]
+        await retener_imagenes(session, [v["imagen"] for v, _ in insertadas])
+        await asociar_rutas(session, [
+            (nuevas[e.nombre_estacion], ruta)
+            for _, e in insertadas
+            for ruta in parse_rutas(e.rutas_asociadas)
+        ])
+    return creadas
+
+_ELIMINAR_ESTACIONES_SQL = text(
+    "WITH borradas AS ("
+    " DELETE FROM estaciones WHERE id = ANY(CAST(:ids AS INTEGER[]))"
+    " RETURNING id, nombre_estacion, localidad, imagen, imagen_variantes), "
+    "historial AS ("
+    " INSERT INTO historial_eliminados (tipo, registro_id, nombre_estacion, localidad)"
+    " SELECT 'estacion', id, nombre_estacion, localidad FROM borradas) "
+    "SELECT id, nombre_estacion, localidad, imagen, imagen_variantes FROM borradas"
+).columns(imagen_variantes=JSONB)
+
+async def eliminar_estaciones_lote(session: AsyncSession, ids: List[int]) -> list:
+    """DELETE ... WHERE id = ANY(:ids) RETURNING y COMMIT, con su historial; devuelve las filas borradas."""
+    if not ids:
+        return []
+    result = await session.execute(_ELIMINAR_ESTACIONES_SQL, {"ids": list(ids)})
+    eliminadas = result.all()
+    await liberar_imagenes(session, [(e.imagen, e.imagen_variantes) for e in eliminadas])
     await session.commit()
-    await session.refresh(estacion)
-    return estacion
+    return eliminadas
 
-async def actualizar_imagen_estacion(session: AsyncSession, estacion_id: int, imagen_url: str) -> Optional[Estacion]: 
-    result = await session.execute(select(Estacion).where(Estacion.id == estacion_id))
-    estacion = result.scalar_one_or_none()
-    if not estacion:
-        return None
-    estacion.imagen = imagen_url
+async def eliminar_estacion(session: AsyncSession, estacion_id: int):
+    """Devuelve la fila borrada (id, nombre_estacion, localidad, imagen) o None si no existía."""
+    eliminadas = await eliminar_estaciones_lote(session, [estacion_id])
+    return eliminadas[0] if eliminadas else None
+
+async def actualizar_estacion(
+    session: AsyncSession, estacion_id: int, subida: Optional[Dict] = None, **valores
+) -> Optional[EstacionResponse]:
+    """UPDATE ... RETURNING y COMMIT; None si la estación no existe.
+
+    Si cambia `rutas_asociadas`, ruta_estacion se ajusta en la misma transacción.
+    """
+    for campo in ("nombre_estacion", "localidad"):
+        if campo in valores:
+            valores[f"{campo}_norm"] = _normalize_optional(valores[campo])
+    fila = await _actualizar_fila(session, Estacion.__table__, estacion_id, valores, ESTACION_RETURNING, subida)
+    if fila is not None and "rutas_asociadas" in valores:
+        await sincronizar_rutas_estacion(session, estacion_id, valores["rutas_asociadas"])
     await session.commit()
-    await session.refresh(estacion)
-    return estacion
+    return EstacionResponse.model_validate(fila) if fila else None
+
+async def actualizar_estado_estacion(session: AsyncSession, estacion_id: int, nuevo_estado: bool) -> Optional[EstacionResponse]: 
+    return await actualizar_estacion(session, estacion_id, activo=nuevo_estado)
+
+async def actualizar_imagen_estacion(
+    session: AsyncSession, estacion_id: int, clave: str, variantes: Optional[Dict] = None
+) -> Optional[EstacionResponse]:
+    """Cambia la imagen de la estación por `clave` (ya guardada en el storage) y COMMIT; None si no existe."""
+    fila = await _cambiar_imagen(session, Estacion.__table__, estacion_id, clave, variantes, ESTACION_RETURNING)
+    return EstacionResponse.model_validate(fila) if fila else None
 
 async def get_all_estacion_ids(session: AsyncSession) -> List[int]: 
     result = await session.execute(select(Estacion.id))
     return result.scalars().all()
+
+
+
+# ---------------------- IMÁGENES ----------------------
+async def _actualizar_fila(session: AsyncSession, tabla, registro_id: int, valores: Dict, returning, subida: Optional[Dict] = None):
+    """UPDATE ... RETURNING de `valores`, sin confirmar; devuelve la fila o None si no existe.
+
+    Con `subida` (resultado de `save_file`) también cambia la imagen. Un CTE
+    con FOR UPDATE lee la imagen anterior en la misma sentencia, así que dos
+    ediciones simultáneas no la sueltan dos veces. Si la fila no existe, la
+    imagen subida se suelta enseguida y se encola su borrado si nadie la usa.
+    """
+    if subida is None:
+        if not valores:
+            return (await session.execute(select(*returning).where(tabla.c.id == registro_id))).one_or_none()
+        result = await session.execute(
+            update(tabla).where(tabla.c.id == registro_id).values(**valores).returning(*returning)
+        )
+        return result.one_or_none()
+
+    anterior = (
+        select(tabla.c.id, tabla.c.imagen.label("imagen_anterior"), tabla.c.imagen_variantes.label("variantes_anteriores"))
+        .where(tabla.c.id == registro_id)
+        .with_for_update()
+        .cte("anterior")
+    )
+    result = await session.execute(
+        update(tabla).where(tabla.c.id == anterior.c.id)
+        .values(**valores, imagen=subida["key"], imagen_variantes=subida.get("variantes"))
+        .returning(*returning, anterior.c.imagen_anterior, anterior.c.variantes_anteriores)
+    )
+    fila = result.one_or_none()
+    await registrar_imagen(session, subida)
+    if fila is None:
+        await liberar_imagenes(session, [(subida["key"], subida.get("variantes"))])
+    else:
+        await liberar_imagenes(session, [(fila.imagen_anterior, fila.variantes_anteriores)])
+    return fila
+
+async def _cambiar_imagen(session: AsyncSession, tabla, registro_id: int, clave: str, variantes: Optional[Dict], returning):
+    """UPDATE de imagen/imagen_variantes con el mismo conteo de referencias que la edición por formulario.
+
+    Bloquea la fila para leer la imagen anterior, suma la referencia de la
+    nueva y suelta la anterior (que se borra si nadie más la usa) en la
+    misma transacción. Devuelve la fila actualizada o None.
+    """
+    anterior = (await session.execute(
+        select(tabla.c.imagen, tabla.c.imagen_variantes).where(tabla.c.id == registro_id).with_for_update()
+    )).one_or_none()
+    if anterior is None:
+        await session.rollback()
+        return None
+    clave = key_from_url(clave) or clave
+    result = await session.execute(
+        update(tabla).where(tabla.c.id == registro_id)
+        .values(imagen=clave, imagen_variantes=variantes)
+        .returning(*returning)
+    )
+    fila = result.one()
+    await retener_imagenes(session, [clave])
+    await liberar_imagenes(session, [(anterior.imagen, anterior.imagen_variantes)])
+    await session.commit()
+    return fila
+
+# ---------------------- RUTAS ----------------------
+async def sincronizar_rutas_estacion(session: AsyncSession, estacion_id: int, rutas_asociadas: Optional[str]) -> None:
+    """Ajusta ruta_estacion al texto de rutas_asociadas (sin confirmar la transacción)."""
+    nombres = parse_rutas(rutas_asociadas)
+    ruta_ids: List[int] = []
+    if nombres:
+        await session.execute(
+            pg_insert(Ruta.__table__)
+            .values([{"nombre_ruta": n, "activo": True} for n in nombres])
+            .on_conflict_do_nothing(index_elements=["nombre_ruta"])
+        )
+        result = await session.execute(select(Ruta.id).where(Ruta.nombre_ruta.in_(nombres)))
+        ruta_ids = result.scalars().all()
+
+    borrar = delete(ruta_estacion).where(ruta_estacion.c.estacion_id == estacion_id)
+    if ruta_ids:
+        borrar = borrar.where(ruta_estacion.c.ruta_id.notin_(ruta_ids))
+    await session.execute(borrar)
+    if ruta_ids:
+        await session.execute(
+            pg_insert(ruta_estacion)
+            .values([{"ruta_id": r, "estacion_id": estacion_id} for r in ruta_ids])
+            .on_conflict_do_nothing()
+        )
+
+async def asociar_rutas(executor, pares: List[tuple]) -> None:
+    """Agrega pares (estacion_id, nombre_ruta) en dos sentencias, creando las rutas que falten.
+
+    `executor` puede ser una AsyncSession o una AsyncConnection.
+    """
+    if not pares:
+        return
+    await executor.execute(
+        text(
+            "INSERT INTO rutas (nombre_ruta, activo) "
+            "SELECT DISTINCT unnest(CAST(:nombres AS VARCHAR[])), true "
+            "ON CONFLICT (nombre_ruta) DO NOTHING"
+        ),
+        {"nombres": [n for _, n in pares]},
+    )
+    await executor.execute(
+        text(
+            "INSERT INTO ruta_estacion (ruta_id, estacion_id) "
+            "SELECT r.id, p.estacion_id "
+            "FROM unnest(CAST(:eids AS INTEGER[]), CAST(:nombres AS VARCHAR[])) AS p (estacion_id, nombre) "
+            "JOIN rutas r ON r.nombre_ruta = p.nombre "
+            "ON CONFLICT DO NOTHING"
+        ),
+        {"eids": [e for e, _ in pares], "nombres": [n for _, n in pares]},
+    )
+
+async def obtener_estaciones_por_ruta(session: AsyncSession, nombre_ruta: str) -> Optional[Ruta]:
+    """Ruta con sus estaciones: búsqueda por índice + un selectin, sin N+1."""
+    result = await session.execute(
+        select(Ruta)
+        .where(Ruta.nombre_ruta == nombre_ruta.strip().upper())
+        .options(selectinload(Ruta.estaciones))
+    )
+    return result.scalar_one_or_none()
+
+async def obtener_rutas_por_estacion(session: AsyncSession, estacion_id: int) -> Optional[Estacion]:
+    result = await session.execute(
+        select(Estacion)
+        .where(Estacion.id == estacion_id)
+        .options(selectinload(Estacion.rutas))
+    )
+    return result.scalar_one_or_none()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import zlib
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+import anyio
+
+from app.operations.crud import contains_pattern
+from app.services.storage import PUBLIC_BASE_URL, current_base_url, image_url_prefix
+
+# Chunks de COPY en cola antes de frenar a Postgres (contrapresión).
+EXPORT_QUEUE_CHUNKS = 16
+
+BUS_COLUMNS = "id, nombre_bus, tipo, activo, {imagen}"
+ESTACION_COLUMNS = "id, nombre_estacion, localidad, rutas_asociadas, activo, {imagen}"
+
+# La misma URL que arma `storage.image_url` para la API, calculada en Postgres:
+# las URLs completas pasan tal cual, las relativas al sitio se completan con la
+# URL base y las claves llevan delante el prefijo del proxy o del backend. Las
+# claves que genera la app solo usan caracteres seguros en una URL, así que no
+# hace falta codificarlas.
+_IMAGEN_SQL = (
+    "CASE WHEN imagen IS NULL OR imagen = '' OR imagen LIKE '%://%' OR imagen LIKE '//%' THEN imagen"
+    " WHEN imagen LIKE '/%' THEN {base} || imagen"
+    " ELSE {prefijo} || imagen END AS imagen"
+)
+
+def _where(condiciones: List[Tuple[str, object]]) -> Tuple[str, list]:
+    partes, args = [], []
+    for plantilla, valor in condiciones:
+        if valor is not None:
+            args.append(valor)
+            partes.append(plantilla.format(f"${len(args)}"))
+    return (" WHERE " + " AND ".join(partes)) if partes else "", args
+
+def _imagen(args: list) -> str:
+    """Expresión de la columna `imagen` con URL absoluta; agrega sus parámetros a `args`."""
+    args.append(image_url_prefix())
+    prefijo = f"${len(args)}"
+    args.append(PUBLIC_BASE_URL or current_base_url.get() or "")
+    return _IMAGEN_SQL.format(prefijo=prefijo, base=f"${len(args)}")
+
+def buses_query(bus_id=None, tipo=None, activo=None, nombre=None) -> Tuple[str, list]:
+    where, args = _where([
+        ("id = {}", bus_id),
+        ("tipo = {}", tipo),
+        ("activo = {}", activo),
+        ("nombre_bus_norm LIKE {}", contains_pattern(nombre) if nombre is not None else None),
+    ])
+    columnas = BUS_COLUMNS.format(imagen=_imagen(args))
+    return f"SELECT {columnas} FROM buses{where} ORDER BY id", args
+
+def estaciones_query(estacion_id=None, localidad=None, activo=None, nombre=None) -> Tuple[str, list]:
+    where, args = _where([
+        ("id = {}", estacion_id),
+        ("localidad_norm LIKE {}", contains_pattern(localidad) if localidad is not None else None),
+        ("activo = {}", activo),
+        ("nombre_estacion_norm LIKE {}", contains_pattern(nombre) if nombre is not None else None),
+    ])
+    columnas = ESTACION_COLUMNS.format(imagen=_imagen(args))
+    return f"SELECT {columnas} FROM estaciones{where} ORDER BY id", args
+
+def _copy_options(formato: str) -> Tuple[str, dict]:
+    if formato == "ndjson":
+        # Una línea JSON por fila. Con CSV y comillas/delimitador en caracteres
+        # de control que JSON siempre escapa, Postgres nunca cita ni escapa.
+        return "SELECT row_to_json(t) FROM ({}) t", {"format": "csv", "quote": "\x01", "delimiter": "\x02"}
+    return "{}", {"format": "csv", "header": True}
+
+async def copy_export(
+    open_session: Callable,
+    query: str,
+    args: list,
+    formato: str,
+    comprimir: bool = False,
+) -> AsyncIterator[bytes]:
+    """Transmite `COPY (query) TO STDOUT` de asyncpg sin materializar el resultado.
+
+    Una tarea productora escribe los chunks de COPY en una cola acotada; si el
+    cliente lee lento, la cola se llena, asyncpg deja de leer del socket y
+    Postgres se frena. Con `comprimir` cada chunk pasa por gzip incremental.
+    """
+    envoltura, opciones = _copy_options(formato)
+    cola: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    fin = object()
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+
+    # La sesión se cierra a mano en el `finally` para poder protegerla de la
+    # cancelación: si el cliente se desconecta, Starlette cancela la tarea de
+    # la respuesta y cualquier await sin escudo se cancelaría también.
+    pila = AsyncExitStack()
+    tarea = None
+    terminado = False
+    try:
+        session = await pila.enter_async_context(open_session())
+        conn = await session.connection()
+        raw = await conn.get_raw_connection()
+        driver = raw.driver_connection
+
+        async def producir():
+            try:
+                await driver.copy_from_query(envoltura.format(query), *args, output=cola.put, **opciones)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await cola.put(e)
+                return
+            await cola.put(fin)
+
+        tarea = asyncio.create_task(producir())
+        while True:
+            chunk = await cola.get()
+            if chunk is fin:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if gzip is not None:
+                chunk = gzip.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        await tarea
+        terminado = True
+        if gzip is not None:
+            yield gzip.flush()
+    finally:
+        with anyio.CancelScope(shield=True):
+            if tarea is not None and not terminado:
+                tarea.cancel()
+                await asyncio.wait([tarea], timeout=5)
+                # Un COPY interrumpido deja la conexión en estado incierto.
+                logging.warning("Exportación interrumpida; se descarta la conexión.")
+                await conn.invalidate()
+            await pila.aclose()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import Integer, bindparam, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import HistorialEliminacion
+
+# ---------------------- CONFIG ----------------------
+# Días que se conserva cada registro del historial; 0 desactiva la poda.
+HISTORIAL_RETENTION_DAYS = float(os.getenv("HISTORIAL_RETENTION_DAYS", "90"))
+HISTORIAL_PRUNE_INTERVAL = float(os.getenv("HISTORIAL_PRUNE_INTERVAL", "3600"))
+# Filas borradas por sentencia al podar, para no retener locks mucho tiempo.
+HISTORIAL_PRUNE_BATCH = int(os.getenv("HISTORIAL_PRUNE_BATCH", "5000"))
+
+# ---------------------- CONSULTA ----------------------
+async def obtener_historial(
+    session: AsyncSession,
+    tipo: Optional[str] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100
+) -> List[HistorialEliminacion]:
+    """Eliminaciones de la más reciente a la más antigua; `before_id` pagina por keyset."""
+    query = select(HistorialEliminacion)
+    if tipo is not None:
+        query = query.where(HistorialEliminacion.tipo == tipo)
+    if desde is not None:
+        query = query.where(HistorialEliminacion.fecha_hora >= desde)
+    if hasta is not None:
+        query = query.where(HistorialEliminacion.fecha_hora < hasta)
+    if before_id is not None:
+        query = query.where(HistorialEliminacion.id < before_id)
+    query = query.order_by(HistorialEliminacion.id.desc()).limit(limit)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+# ---------------------- PODA ----------------------
+async def podar_historial(session: AsyncSession, retention_days: float = HISTORIAL_RETENTION_DAYS) -> int:
+    """Borra por lotes los registros más viejos que `retention_days`; devuelve cuántos."""
+    if retention_days <= 0:
+        return 0
+    limite = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    tabla = HistorialEliminacion.__table__
+    viejos = (
+        select(tabla.c.id)
+        .where(tabla.c.fecha_hora < limite)
+        .limit(bindparam("lote", type_=Integer))
+        .scalar_subquery()
+    )
+    total = 0
+    while True:
+        result = await session.execute(delete(tabla).where(tabla.c.id.in_(viejos)), {"lote": HISTORIAL_PRUNE_BATCH})
+        await session.commit()
+        total += result.rowcount
+        if result.rowcount < HISTORIAL_PRUNE_BATCH:
+            return total
+
+async def run_historial_pruning(open_session, interval: float = HISTORIAL_PRUNE_INTERVAL):
+    """Bucle de fondo que poda el historial cada `interval` segundos.
+
+    Espera un intervalo antes de la primera poda para no tocar la base al arrancar.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with open_session() as session:
+                borrados = await podar_historial(session)
+            if borrados:
+                logging.info(f"Historial: {borrados} registros antiguos eliminados.")
+        except Exception as e:
+            logging.error(f"Error al podar el historial de eliminaciones: {e}")
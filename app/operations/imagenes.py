@@ -0,0 +1,179 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Imagen
+from app.services.images import variant_urls
+from app.services.jobs import encolar
+
+# Clave de un objeto direccionado por contenido: '<bucket>/image/sha256/<hex>.<ext>'.
+_CLAVE_RE = re.compile(r"(?:^|/)sha256/([0-9a-f]{64})(?:[._/]|$)")
+
+def content_key(path: str) -> Optional[str]:
+    """Hash sha256 de una ruta direccionada por contenido, o None (subidas antiguas con uuid)."""
+    m = _CLAVE_RE.search(path)
+    return m.group(1) if m else None
+
+# ---------------------- CONSULTAS ----------------------
+# También revive una imagen con 0 referencias cuyo borrado sigue pendiente:
+# el worker solo borra si al tomar el lock la cuenta sigue en 0.
+_TOMAR_SQL = text(
+    "UPDATE imagenes SET referencias = referencias + 1 "
+    "WHERE bucket = :bucket AND sha256 = :sha256 "
+    "RETURNING clave, variantes"
+).columns(variantes=JSONB)
+
+async def tomar_imagen(session: AsyncSession, bucket: str, sha256: str) -> Optional[Dict]:
+    """Si el bucket ya tiene la imagen, le suma una referencia y devuelve {"key", "variantes"}.
+
+    None si hay que subirla. La referencia va en la transacción de `session`
+    y el UPDATE bloquea la fila hasta el COMMIT, así que el worker de borrado
+    (`reclamar_borrables`) no puede borrar el objeto entre la búsqueda y el
+    alta de la fila que lo usa.
+    """
+    fila = (await session.execute(_TOMAR_SQL, {"bucket": bucket, "sha256": sha256})).one_or_none()
+    return {"key": fila.clave, "variantes": fila.variantes} if fila else None
+
+# ---------------------- REFERENCIAS ----------------------
+# Agrupa las claves repetidas: 50 buses con la misma foto suman o restan 50 de una vez.
+_CONTEO = "SELECT k AS clave, count(*) AS n FROM unnest(CAST(:claves AS VARCHAR[])) k GROUP BY k"
+
+# Las claves ya registradas suman sus repeticiones. Las que no están (subidas
+# antiguas con nombre uuid, o una imagen cuyo registro se limpió) se registran
+# contando todas las filas que ya las usan, incluidas las recién insertadas
+# en esta transacción; así dos filas con la misma clave antigua quedan protegidas.
+# Ante una inserción concurrente de la misma clave se suman ambas cuentas: a lo
+# sumo sobra una referencia y la imagen no se borra, nunca al revés.
+_RETENER_SQL = text(
+    f"WITH c AS ({_CONTEO}), "
+    "sumadas AS ("
+    " UPDATE imagenes i SET referencias = i.referencias + c.n FROM c WHERE i.clave = c.clave RETURNING i.clave), "
+    "usos AS ("
+    " SELECT imagen AS clave, count(*) AS filas FROM ("
+    " SELECT imagen FROM buses WHERE imagen = ANY(CAST(:claves AS VARCHAR[]))"
+    " UNION ALL SELECT imagen FROM estaciones WHERE imagen = ANY(CAST(:claves AS VARCHAR[]))) u"
+    " GROUP BY imagen) "
+    "INSERT INTO imagenes (bucket, sha256, clave, referencias) "
+    "SELECT split_part(c.clave, '/', 1),"
+    " COALESCE(substring(c.clave from 'sha256/([0-9a-f]{64})'), 'clave:' || md5(c.clave)),"
+    " c.clave, COALESCE(u.filas, 0) "
+    "FROM c LEFT JOIN usos u ON u.clave = c.clave "
+    "WHERE c.clave NOT IN (SELECT clave FROM sumadas) "
+    "ON CONFLICT (clave) DO UPDATE SET referencias = imagenes.referencias + EXCLUDED.referencias"
+)
+
+_SOLTAR_SQL = text(
+    f"UPDATE imagenes i SET referencias = i.referencias - c.n FROM ({_CONTEO}) c "
+    "WHERE i.clave = c.clave RETURNING i.clave, i.referencias"
+)
+
+# Quitan (y bloquean hasta el COMMIT) las filas que siguen en 0 referencias.
+_RECLAMAR_CONTENIDO_SQL = text(
+    "DELETE FROM imagenes i USING unnest(CAST(:buckets AS VARCHAR[]), CAST(:hashes AS VARCHAR[])) AS c (bucket, sha256) "
+    "WHERE i.bucket = c.bucket AND i.sha256 = c.sha256 AND i.referencias <= 0 "
+    "RETURNING i.bucket, i.sha256"
+)
+
+_EN_USO_SQL = text(
+    "SELECT clave FROM imagenes WHERE clave = ANY(CAST(:claves AS VARCHAR[])) AND referencias > 0 FOR UPDATE"
+)
+
+_OLVIDAR_SQL = text(
+    "DELETE FROM imagenes WHERE clave = ANY(CAST(:claves AS VARCHAR[])) AND referencias <= 0"
+)
+
+async def registrar_imagen(session: AsyncSession, subida: Dict) -> None:
+    """Suma una referencia a la imagen que devolvió `save_file`, en la transacción actual.
+
+    La primera referencia crea la fila; las subidas sin "sha256" (errores)
+    y las que reutilizaron una imagen (ya la tomó `tomar_imagen`) no hacen nada.
+    """
+    if not subida.get("sha256") or subida.get("retenida"):
+        return
+    tabla = Imagen.__table__
+    stmt = pg_insert(tabla).values(
+        bucket=subida["bucket"],
+        sha256=subida["sha256"],
+        clave=subida["key"],
+        variantes=subida.get("variantes"),
+        referencias=1,
+    )
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[tabla.c.bucket, tabla.c.sha256],
+        set_={
+            "referencias": tabla.c.referencias + 1,
+            "variantes": func.coalesce(tabla.c.variantes, stmt.excluded.variantes),
+        },
+    ))
+
+async def retener_imagenes(session: AsyncSession, claves: List[Optional[str]]) -> None:
+    """Suma una referencia por clave (p. ej. altas masivas que reutilizan una imagen ya subida).
+
+    Se llama después de insertar las filas. Las claves que no están en
+    `imagenes` se registran con la cuenta de filas que las usan; las URLs
+    externas se ignoran.
+    """
+    claves = [k for k in claves if k and "://" not in k]
+    if claves:
+        await session.execute(_RETENER_SQL, {"claves": claves})
+
+async def liberar_imagenes(session: AsyncSession, imagenes: List[Tuple[Optional[str], Optional[Dict]]]) -> None:
+    """Resta una referencia por cada (clave, variantes) y encola el borrado de las que quedan sin uso.
+
+    Todo ocurre en la transacción actual: si no se confirma, ni los
+    contadores ni el trabajo de borrado cambian. Las filas que llegan a 0
+    se conservan hasta que el worker borra el objeto (ver
+    `reclamar_borrables`); mientras tanto una subida de la misma imagen
+    puede volver a tomarla. Las claves que no están en `imagenes` también
+    se encolan.
+    """
+    claves = [clave for clave, _ in imagenes if clave]
+    if not claves:
+        return
+    result = await session.execute(_SOLTAR_SQL, {"claves": claves})
+    restantes = {f.clave: f.referencias for f in result}
+
+    grupos: List[List] = []
+    vistas = set()
+    for clave, variantes in imagenes:
+        if not clave or clave in vistas or restantes.get(clave, 0) > 0:
+            continue
+        vistas.add(clave)
+        grupos.append([clave, variant_urls(variantes)])
+    if grupos:
+        await encolar(session, "eliminar_imagenes", {"imagenes": grupos})
+
+async def reclamar_borrables(session: AsyncSession, claves: Iterable[str]) -> Set[str]:
+    """De las claves originales dadas, las que se pueden borrar del storage ahora.
+
+    Quita de `imagenes` las filas que siguen en 0 referencias; sus locks
+    duran hasta el COMMIT de `session`, así que hay que borrar los objetos
+    antes de confirmar. Una subida que intenta tomar la imagen mientras
+    tanto espera y, al confirmarse el borrado, la vuelve a subir. Una clave
+    por contenido sin fila no se borra (ya se limpió o hay una subida nueva
+    en curso); una clave antigua sin fila sí.
+    """
+    por_hash: Dict[Tuple[str, str], Set[str]] = {}
+    antiguas: List[str] = []
+    for clave in set(claves):
+        sha256 = content_key(clave)
+        if sha256 is None:
+            antiguas.append(clave)
+        else:
+            bucket, _, _ = clave.partition("/")
+            por_hash.setdefault((bucket, sha256), set()).add(clave)
+
+    borrables: Set[str] = set()
+    if por_hash:
+        buckets, hashes = zip(*por_hash)
+        result = await session.execute(_RECLAMAR_CONTENIDO_SQL, {"buckets": list(buckets), "hashes": list(hashes)})
+        for fila in result:
+            borrables |= por_hash[(fila.bucket, fila.sha256)]
+    if antiguas:
+        en_uso = set((await session.execute(_EN_USO_SQL, {"claves": antiguas})).scalars().all())
+        await session.execute(_OLVIDAR_SQL, {"claves": antiguas})
+        borrables |= set(antiguas) - en_uso
+    return borrables
@@ -0,0 +1,36 @@
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple, TypeVar
+
+from fastapi import HTTPException, Response
+
+T = TypeVar("T")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(last_id: int) -> str:
+    """Cursor opaco con el último id entregado."""
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(cursor + relleno))["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+
+def split_page(rows: Sequence[T], limit: int) -> Tuple[List[T], Optional[str]]:
+    """Recibe hasta limit + 1 filas ordenadas por id; devuelve la página y el cursor siguiente."""
+    pagina = list(rows[:limit])
+    siguiente = encode_cursor(pagina[-1].id) if len(rows) > limit and pagina else None
+    return pagina, siguiente
+
+def set_next_cursor(response: Response, request_url, siguiente: Optional[str]) -> None:
+    """Expone el cursor en X-Next-Cursor y en un Link rel="next"."""
+    if siguiente is None:
+        return
+    response.headers["X-Next-Cursor"] = siguiente
+    response.headers["Link"] = f'<{request_url.include_query_params(cursor=siguiente)}>; rel="next"'
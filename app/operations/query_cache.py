@@ -0,0 +1,52 @@
+import threading
+from typing import Callable, Dict, Hashable
+
+class StatementCache:
+    """Sentencias construidas una sola vez por firma de filtros.
+
+    Cada firma (el conjunto de filtros presentes) produce siempre el mismo
+    objeto `select()` con `bindparam`s, de modo que SQLAlchemy reutiliza la
+    compilación y asyncpg reutiliza la sentencia preparada en el servidor,
+    porque el SQL es idéntico entre peticiones.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._statements: Dict[Hashable, object] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, signature: Hashable, builder: Callable[[Hashable], object]):
+        stmt = self._statements.get(signature)
+        if stmt is not None:
+            self.hits += 1
+            return stmt
+        with self._lock:
+            stmt = self._statements.get(signature)
+            if stmt is None:
+                self.misses += 1
+                stmt = builder(signature)
+                self._statements[signature] = stmt
+            else:
+                self.hits += 1
+        return stmt
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "signatures": len(self._statements),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+_caches: Dict[str, StatementCache] = {}
+
+def statement_cache(name: str) -> StatementCache:
+    if name not in _caches:
+        _caches[name] = StatementCache(name)
+    return _caches[name]
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
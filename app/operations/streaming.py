@@ -0,0 +1,37 @@
+from typing import AsyncIterator, Callable, List, Type
+
+from pydantic import BaseModel
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+async def stream_models(
+    open_session: Callable,
+    fetch_batches: Callable,
+    schema: Type[BaseModel],
+    formato: str,
+) -> AsyncIterator[bytes]:
+    """Serializa lotes de filas a medida que llegan del cursor del servidor.
+
+    El generador abre su propia sesión: las dependencias de FastAPI se cierran
+    antes de que empiece a enviarse el cuerpo de un StreamingResponse. En
+    memoria solo vive el lote actual, nunca la lista completa.
+    """
+    primero = True
+    async with open_session() as session:
+        if formato == "json":
+            yield b"["
+        async for lote in fetch_batches(session):
+            partes: List[str] = [schema.model_validate(obj).model_dump_json() for obj in lote]
+            if not partes:
+                continue
+            if formato == "json":
+                chunk = ",".join(partes)
+                yield (chunk if primero else "," + chunk).encode()
+            else:
+                yield ("\n".join(partes) + "\n").encode()
+            primero = False
+        if formato == "json":
+            yield b"]"
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, field_serializer
+from typing import Dict, List, Optional
 from enum import Enum
 from fastapi import Form, UploadFile, File
+from app.services.storage import image_url, variant_image_urls
 
 # ---------------------- ENUM ----------------------
 
@@ -32,6 +33,16 @@ class BusResponse(BaseModel):
     tipo: str
     activo: bool
     imagen: Optional[str] = None
+    imagen_variantes: Optional[Dict[str, Dict[str, str]]] = None
+
+    # La fila guarda claves del backend; la API responde URLs públicas.
+    @field_serializer("imagen")
+    def _imagen_url(self, imagen: Optional[str]) -> Optional[str]:
+        return image_url(imagen)
+
+    @field_serializer("imagen_variantes")
+    def _variantes_urls(self, variantes: Optional[Dict[str, Dict[str, str]]]) -> Optional[Dict[str, Dict[str, str]]]:
+        return variant_image_urls(variantes)
 
     class Config:
         from_attributes = True
@@ -89,6 +100,16 @@ class EstacionResponse(BaseModel):
     rutas_asociadas: str
     activo: bool
     imagen: Optional[str] = None
+    imagen_variantes: Optional[Dict[str, Dict[str, str]]] = None
+
+    # La fila guarda claves del backend; la API responde URLs públicas.
+    @field_serializer("imagen")
+    def _imagen_url(self, imagen: Optional[str]) -> Optional[str]:
+        return image_url(imagen)
+
+    @field_serializer("imagen_variantes")
+    def _variantes_urls(self, variantes: Optional[Dict[str, Dict[str, str]]]) -> Optional[Dict[str, Dict[str, str]]]:
+        return variant_image_urls(variantes)
 
     class Config:
         from_attributes = True
@@ -121,4 +142,23 @@ class EstacionUpdateForm:
         self.localidad = localidad
         self.rutas_asociadas = rutas_asociadas
         self.activo = activo
-        self.imagen = imagen
\ No newline at end of file
+        self.imagen = imagen
+
+
+# ---------------------- ELIMINACIÓN MASIVA ----------------------
+
+class IdsRequest(BaseModel):
+    ids: List[int]
+
+
+# ---------------------- RUTAS ----------------------
+
+class RutaResponse(BaseModel):
+    id: int
+    nombre_ruta: str
+    tipo_servicio: Optional[str] = None
+    horario: Optional[str] = None
+    activo: Optional[bool] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import aiofiles
+import aiofiles.os
+
+from app.services.media import open_file
+from app.services.storage import split_key
+from app.services.storage_client import get_storage_client
+
+# ---------------------- CONFIG ----------------------
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", ".image_cache")
+# Tope por proceso (worker): cada uno cuenta solo lo que descargó o encontró al
+# arrancar, así que con N workers el directorio compartido puede llegar a N veces
+# este valor. Al pasarlo se borran las imágenes usadas hace más tiempo.
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Descargas por petición si el archivo desaparece entre `fetch` y la apertura.
+_INTENTOS_APERTURA = 3
+
+class ImageCache:
+    """Copia en disco de las imágenes del almacenamiento remoto, con desalojo LRU.
+
+    Cada clave se guarda como `<sha256 de la clave><ext>`. El índice LRU vive
+    en memoria y se reconstruye al arrancar a partir de los archivos (los más
+    viejos primero). Varias peticiones que fallan a la vez sobre la misma
+    clave esperan una única descarga; esa descarga corre en su propia tarea,
+    así que si el cliente que la inició se desconecta las demás no se cancelan.
+
+    El índice y el tope (`max_bytes`) son de cada proceso aunque el
+    directorio se comparta: con N workers la caché puede ocupar hasta N
+    veces `max_bytes`. Un worker puede desalojar un archivo que otro está
+    por servir; `open` lo vuelve a descargar en ese caso.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._loaded: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _nombre(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest() + os.path.splitext(key)[1].lower()
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.directory, nombre[:2], nombre)
+
+    # ---------------------- ÍNDICE ----------------------
+    def _scan(self):
+        """Lee los archivos existentes (más viejos primero) y borra temporales a medias."""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directory):
+            for nombre in nombres:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    if nombre.endswith(".tmp"):
+                        os.remove(ruta)
+                        continue
+                    stat = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                archivos.append((stat.st_mtime, nombre, stat.st_size))
+        archivos.sort()
+        return archivos
+
+    async def _load(self):
+        for _, nombre, tamano in await asyncio.to_thread(self._scan):
+            self._index[nombre] = tamano
+            self._total += tamano
+        await self._evict()
+        logging.info(f"Caché de imágenes: {len(self._index)} archivos, {self._total} bytes.")
+
+    async def _ensure_loaded(self):
+        if self._loaded is None:
+            self._loaded = asyncio.create_task(self._load())
+        await self._loaded
+
+    async def _add(self, nombre: str, tamano: int):
+        self._total -= self._index.pop(nombre, 0)
+        self._index[nombre] = tamano
+        self._total += tamano
+        await self._evict()
+
+    def _forget(self, nombre: str):
+        self._total -= self._index.pop(nombre, 0)
+
+    async def _evict(self):
+        """Borra las imágenes menos usadas hasta quedar bajo `max_bytes` (conserva la última).
+
+        Las víctimas salen del índice antes del primer `await`, así que otra
+        petición no las ve como aciertos mientras se borran los archivos.
+        """
+        victimas = []
+        while self._total > self.max_bytes and len(self._index) > 1:
+            nombre, tamano = self._index.popitem(last=False)
+            self._total -= tamano
+            self.evictions += 1
+            victimas.append(nombre)
+        for nombre in victimas:
+            try:
+                await aiofiles.os.remove(self._ruta(nombre))
+            except FileNotFoundError:
+                pass
+
+    # ---------------------- LECTURA ----------------------
+    async def fetch(self, key: str) -> str:
+        """Ruta local de la imagen `key`, descargándola del almacenamiento si no está."""
+        await self._ensure_loaded()
+        nombre = self._nombre(key)
+        ruta = self._ruta(nombre)
+        if nombre in self._index:
+            if await aiofiles.os.path.exists(ruta):
+                self._index.move_to_end(nombre)
+                self.hits += 1
+                return ruta
+            # Otro proceso la desalojó del directorio compartido.
+            self._forget(nombre)
+
+        tarea = self._inflight.get(nombre)
+        if tarea is None:
+            self.misses += 1
+            tarea = asyncio.create_task(self._fill(key, nombre, ruta))
+            self._inflight[nombre] = tarea
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(tarea)
+
+    async def open(self, key: str):
+        """(archivo, stat) de la imagen `key` ya abierta, para `serve_file(..., opened=...)`.
+
+        Entre `fetch` y la apertura otra petición u otro proceso puede
+        desalojar el archivo; en ese caso se olvida y se descarga de nuevo.
+        """
+        for _ in range(_INTENTOS_APERTURA - 1):
+            ruta = await self.fetch(key)
+            try:
+                return await open_file(ruta)
+            except FileNotFoundError:
+                self._forget(self._nombre(key))
+        return await open_file(await self.fetch(key))
+
+    async def _fill(self, key: str, nombre: str, ruta: str) -> str:
+        bucket, path = split_key(key)
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        tamano = 0
+        try:
+            await aiofiles.os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            async with aiofiles.open(temporal, "wb") as f:
+                async for chunk in get_storage_client().download(bucket, path):
+                    tamano += len(chunk)
+                    await f.write(chunk)
+            await aiofiles.os.replace(temporal, ruta)
+            await self._add(nombre, tamano)
+            return ruta
+        except BaseException:
+            try:
+                await aiofiles.os.remove(temporal)
+            except FileNotFoundError:
+                pass
+            raise
+        finally:
+            self._inflight.pop(nombre, None)
+
+    def stats(self) -> Dict:
+        consultas = self.hits + self.misses + self.coalesced
+        return {
+            "archivos": len(self._index),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "fallos_agrupados": self.coalesced,
+            "desalojos": self.evictions,
+            "tasa_aciertos": round(self.hits / consultas, 4) if consultas else 0.0,
+        }
+
+_cache: Optional[ImageCache] = None
+
+def get_image_cache() -> ImageCache:
+    global _cache
+    if _cache is None:
+        _cache = ImageCache()
+    return _cache
@@ -0,0 +1,103 @@
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# ---------------------- CONFIG ----------------------
+# Anchos (px) de las variantes; vacío desactiva el pipeline.
+IMAGE_VARIANT_WIDTHS = [
+    int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "160,320,640").split(",") if w.strip()
+]
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Formato -> (formato de Pillow, content-type, extensión)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+# Pillow es opcional: sin él se guarda solo el original. find_spec evita
+# importarlo al arrancar; solo se importa dentro de los procesos del pool.
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+# ---------------------- ENCODING (proceso aparte) ----------------------
+def render_variants(path: str, widths: List[int], quality: int) -> List[Tuple[str, int, bytes]]:
+    """Redimensiona la imagen de `path` a cada ancho y la codifica en WebP y JPEG.
+
+    Corre en el ProcessPoolExecutor y abre el archivo por ruta, así que el
+    original no se copia entre procesos. Aplica la orientación EXIF y guarda sin
+    metadatos, así que las variantes no llevan EXIF (ni GPS). No amplía:
+    los anchos mayores que el original se omiten.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as original:
+        original.seek(0)
+        imagen = ImageOps.exif_transpose(original)
+        imagen.load()
+
+    variantes = []
+    for ancho in sorted(set(widths)):
+        if ancho >= imagen.width:
+            continue
+        alto = max(1, round(imagen.height * ancho / imagen.width))
+        redimensionada = imagen.resize((ancho, alto), Image.LANCZOS)
+        for formato, (formato_pil, _, _) in VARIANT_FORMATS.items():
+            salida = io.BytesIO()
+            if formato_pil == "JPEG":
+                redimensionada.convert("RGB").save(salida, "JPEG", quality=quality, optimize=True, progressive=True)
+            else:
+                convertida = redimensionada if redimensionada.mode in ("RGB", "RGBA") else redimensionada.convert("RGBA")
+                convertida.save(salida, "WEBP", quality=quality, method=4)
+            variantes.append((formato, ancho, salida.getvalue()))
+    return variantes
+
+# ---------------------- POOL ----------------------
+_executor: Optional[ProcessPoolExecutor] = None
+_semaforo: Optional[asyncio.Semaphore] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+def variants_enabled() -> bool:
+    return PILLOW_AVAILABLE and bool(IMAGE_VARIANT_WIDTHS) and IMAGE_WORKERS > 0
+
+async def generate_variants(path: str) -> List[Tuple[str, int, bytes]]:
+    """Codifica las variantes del archivo `path` en el pool de procesos sin bloquear el event loop.
+
+    Un semáforo limita las imágenes en vuelo a IMAGE_WORKERS para acotar la
+    memoria de los workers.
+    """
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(IMAGE_WORKERS)
+    async with _semaforo:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_executor(), render_variants, path, IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_QUALITY
+        )
+
+def variant_path(path: str, ancho: int, formato: str) -> str:
+    """'buses/image/abc.png' -> 'buses/image/abc_320w.webp' (junto al original)."""
+    base, _ = os.path.splitext(path)
+    return f"{base}_{ancho}w.{VARIANT_FORMATS[formato][2]}"
+
+def variant_urls(variantes: Optional[Dict[str, Dict[str, str]]]) -> List[str]:
+    """Todas las claves de un dict {formato: {ancho: clave}} (para limpiarlas junto al original)."""
+    if not variantes:
+        return []
+    return [url for por_ancho in variantes.values() for url in por_ancho.values()]
+
+def shutdown_image_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        logging.info("Pool de procesos de imágenes detenido.")
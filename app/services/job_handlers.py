@@ -0,0 +1,45 @@
+import logging
+from typing import Dict, List
+
+from app.database.db import new_session
+from app.operations.imagenes import reclamar_borrables
+from app.services.jobs import job_handler
+from app.services.storage import key_from_url, split_key
+from app.services.supabase_client import remove_files
+
+# Claves por llamada a storage.remove([...]).
+STORAGE_REMOVE_BATCH = 1000
+
+@job_handler("eliminar_imagenes")
+async def eliminar_imagenes(payload: dict) -> None:
+    """Borra del storage las imágenes de `payload["imagenes"]` ([clave, [variantes]]).
+
+    Antes de borrar, `reclamar_borrables` vuelve a comprobar bajo lock que
+    cada imagen sigue sin referencias; las que otra fila volvió a tomar
+    después de encolar el trabajo se conservan. Los objetos se borran antes
+    del COMMIT: si una llamada falla se deshace todo, se propaga el error y
+    la cola reintenta el trabajo completo (borrar una clave que ya no existe
+    no es un error). Los trabajos encolados con el formato anterior traen
+    "claves" o "urls" sueltas y se tratan como imágenes sin variantes.
+    """
+    grupos: Dict[str, List[str]] = {}
+    sueltas = [[valor, []] for valor in [*payload.get("claves", []), *payload.get("urls", [])]]
+    for valor, variantes in [*payload.get("imagenes", []), *sueltas]:
+        key = key_from_url(valor)
+        if key is None:
+            logging.warning(f"URL de imagen no reconocida, se omite: {valor}")
+            continue
+        grupos.setdefault(key, []).extend(variantes)
+
+    async with new_session() as session:
+        borrables = await reclamar_borrables(session, list(grupos))
+        por_bucket: Dict[str, List[str]] = {}
+        for key in grupos:
+            if key in borrables:
+                por_bucket.setdefault(split_key(key)[0], []).extend([key, *grupos[key]])
+        for bucket, keys in por_bucket.items():
+            for inicio in range(0, len(keys), STORAGE_REMOVE_BATCH):
+                lote = keys[inicio:inicio + STORAGE_REMOVE_BATCH]
+                await remove_files(lote)
+                logging.info(f"{len(lote)} imagen(es) eliminadas del bucket {bucket}.")
+        await session.commit()
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import insert, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Job
+
+# ---------------------- CONFIG ----------------------
+# Workers por proceso; 0 deja la cola sin consumir (p. ej. si corre aparte
+# con `python -m app.services.jobs`).
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "600"))
+# Un trabajo 'en_proceso' más viejo que esto se da por abandonado (worker caído).
+JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", "300"))
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+MUERTO = "muerto"
+
+JobHandler = Callable[[dict], Awaitable[None]]
+HANDLERS: Dict[str, JobHandler] = {}
+
+def job_handler(tipo: str):
+    """Registra la corrutina que procesa los trabajos de `tipo`."""
+    def registrar(func: JobHandler) -> JobHandler:
+        HANDLERS[tipo] = func
+        return func
+    return registrar
+
+# ---------------------- ENCOLAR ----------------------
+async def encolar(session: AsyncSession, tipo: str, payload: dict, max_intentos: Optional[int] = None) -> None:
+    """Agrega un trabajo a la transacción de `session`, sin confirmar.
+
+    El trabajo queda visible para los workers solo si la transacción que
+    cambió la fila se confirma.
+    """
+    await session.execute(
+        insert(Job.__table__).values(
+            tipo=tipo,
+            payload=payload,
+            max_intentos=max_intentos or JOB_MAX_ATTEMPTS,
+        )
+    )
+
+# ---------------------- SQL ----------------------
+# Un 'en_proceso' abandonado que ya gastó todos sus intentos (p. ej. un
+# trabajo que tumba al worker cada vez) pasa a 'muerto' en vez de reclamarse.
+_RECLAMAR_SQL = text(
+    "UPDATE jobs j SET"
+    " estado = CASE WHEN c.agotado THEN 'muerto' ELSE 'en_proceso' END,"
+    " intentos = CASE WHEN c.agotado THEN j.intentos ELSE j.intentos + 1 END,"
+    " bloqueado_en = CASE WHEN c.agotado THEN NULL ELSE now() END,"
+    " ultimo_error = CASE WHEN c.agotado THEN :abandonado ELSE j.ultimo_error END "
+    "FROM ("
+    " SELECT id, (estado = 'en_proceso' AND intentos >= max_intentos) AS agotado FROM jobs"
+    " WHERE (estado = 'pendiente' AND disponible_en <= now())"
+    " OR (estado = 'en_proceso' AND bloqueado_en < now() - make_interval(secs => :lock_timeout))"
+    " ORDER BY disponible_en"
+    " LIMIT 1"
+    " FOR UPDATE SKIP LOCKED) c "
+    "WHERE j.id = c.id "
+    "RETURNING j.id, j.tipo, j.payload, j.intentos, j.max_intentos, j.estado"
+).columns(payload=JSONB)
+
+_TERMINAR_SQL = text("DELETE FROM jobs WHERE id = :id")
+
+_FALLAR_SQL = text(
+    "UPDATE jobs SET estado = :estado, bloqueado_en = NULL, ultimo_error = :error,"
+    " disponible_en = now() + make_interval(secs => :espera) "
+    "WHERE id = :id"
+)
+
+_CONTEOS_SQL = text(
+    "SELECT estado, count(*) AS total,"
+    " GREATEST(0, EXTRACT(EPOCH FROM now() - min(disponible_en))) AS mas_viejo_s "
+    "FROM jobs GROUP BY estado"
+)
+
+def backoff_seconds(intentos: int) -> float:
+    """Espera exponencial con jitter: base * 2^(intentos-1), con tope JOB_BACKOFF_MAX."""
+    espera = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * (2 ** max(intentos - 1, 0)))
+    return espera * random.uniform(0.5, 1.0)
+
+# ---------------------- METRICS ----------------------
+class JobMetrics:
+    """Contadores del proceso: trabajos completados, reintentados y muertos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completados = 0
+        self.reintentos = 0
+        self.muertos = 0
+        self.duracion_total_ms = 0.0
+        self.duracion_max_ms = 0.0
+        self.por_tipo: Dict[str, Dict[str, int]] = {}
+
+    def observe(self, tipo: str, resultado: str, duracion_ms: float):
+        with self._lock:
+            if resultado == "completado":
+                self.completados += 1
+            elif resultado == "reintento":
+                self.reintentos += 1
+            else:
+                self.muertos += 1
+            self.duracion_total_ms += duracion_ms
+            self.duracion_max_ms = max(self.duracion_max_ms, duracion_ms)
+            contadores = self.por_tipo.setdefault(tipo, {})
+            contadores[resultado] = contadores.get(resultado, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            ejecutados = self.completados + self.reintentos + self.muertos
+            return {
+                "completados": self.completados,
+                "reintentos": self.reintentos,
+                "muertos": self.muertos,
+                "duracion_avg_ms": round(self.duracion_total_ms / ejecutados, 3) if ejecutados else 0.0,
+                "duracion_max_ms": round(self.duracion_max_ms, 3),
+                "por_tipo": {tipo: dict(c) for tipo, c in self.por_tipo.items()},
+            }
+
+# ---------------------- WORKERS ----------------------
+class JobWorkerPool:
+    """Workers asyncio que toman trabajos de la tabla `jobs` con SKIP LOCKED.
+
+    Varios procesos pueden consumir la misma cola sin tomar el mismo trabajo.
+    Un trabajo que falla vuelve a 'pendiente' con backoff exponencial hasta
+    agotar `max_intentos`; entonces queda en 'muerto' para revisión manual.
+    """
+
+    def __init__(self, open_session: Callable, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.open_session = open_session
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.metrics = JobMetrics()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, numero: int):
+        while True:
+            try:
+                procesado = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Worker de trabajos {numero}: error al reclamar trabajo: {e}")
+                procesado = False
+            if not procesado:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> bool:
+        """Reclama y ejecuta un trabajo; False si la cola estaba vacía."""
+        async with self.open_session() as session:
+            job = (await session.execute(_RECLAMAR_SQL, {
+                "lock_timeout": JOB_LOCK_TIMEOUT,
+                "abandonado": "El worker no terminó el último intento (JOB_LOCK_TIMEOUT)",
+            })).one_or_none()
+            await session.commit()
+            if job is None:
+                return False
+            if job.estado == MUERTO:
+                logging.warning(
+                    f"Trabajo {job.id} ({job.tipo}) abandonado en el intento {job.intentos}/{job.max_intentos}; queda muerto."
+                )
+                self.metrics.observe(job.tipo, "muerto", 0.0)
+                return True
+
+            inicio = time.perf_counter()
+            error = None
+            handler = HANDLERS.get(job.tipo)
+            try:
+                if handler is None:
+                    raise LookupError(f"Sin handler para el tipo de trabajo '{job.tipo}'")
+                await handler(job.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+            duracion_ms = (time.perf_counter() - inicio) * 1000
+
+            if error is None:
+                await session.execute(_TERMINAR_SQL, {"id": job.id})
+                resultado = "completado"
+            else:
+                muerto = handler is None or job.intentos >= job.max_intentos
+                await session.execute(_FALLAR_SQL, {
+                    "id": job.id,
+                    "estado": MUERTO if muerto else PENDIENTE,
+                    "error": str(error)[:2000],
+                    "espera": 0.0 if muerto else backoff_seconds(job.intentos),
+                })
+                resultado = "muerto" if muerto else "reintento"
+                logging.warning(
+                    f"Trabajo {job.id} ({job.tipo}) falló en el intento {job.intentos}/{job.max_intentos}: {error}"
+                )
+            await session.commit()
+            self.metrics.observe(job.tipo, resultado, duracion_ms)
+            return True
+
+_pool: Optional[JobWorkerPool] = None
+
+def get_job_pool() -> JobWorkerPool:
+    global _pool
+    if _pool is None:
+        from app.database.db import new_session
+        _pool = JobWorkerPool(new_session)
+    return _pool
+
+async def job_status(session: AsyncSession) -> Dict:
+    """Trabajos por estado en la tabla más los contadores de este proceso."""
+    filas = (await session.execute(_CONTEOS_SQL)).all()
+    return {
+        "cola": {
+            f.estado: {"total": f.total, "mas_viejo_s": round(float(f.mas_viejo_s or 0), 1)}
+            for f in filas
+        },
+        "workers": get_job_pool().workers,
+        "proceso": get_job_pool().metrics.snapshot(),
+    }
+
+if __name__ == "__main__":
+    from app.database.db import dispose_engines
+    from app.services import job_handlers  # noqa: F401  registra los handlers
+
+    async def _main():
+        pool = get_job_pool()
+        pool.workers = max(pool.workers, 1)
+        pool.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await pool.stop()
+            await dispose_engines()
+
+    asyncio.run(_main())
@@ -0,0 +1,160 @@
+import mimetypes
+import os
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import aiofiles
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.operations.imagenes import content_key
+
+# Bytes por lectura al enviar un archivo.
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(256 * 1024)))
+# Las rutas por contenido (sha256) nunca cambian de bytes.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(inicio, fin) inclusivos de un 'Range: bytes=...' con un solo rango.
+
+    None si no hay rango o no se entiende (se responde el archivo completo,
+    como permite la RFC 9110); varios rangos también se responden completos.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    inicio_txt, sep, fin_txt = header[6:].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if inicio_txt == "":
+            sufijo = int(fin_txt)
+            if sufijo <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - sufijo, 0), size - 1
+        inicio = int(inicio_txt)
+        fin = int(fin_txt) if fin_txt else size - 1
+    except ValueError:
+        return None
+    if inicio >= size:
+        raise RangeNotSatisfiable()
+    if inicio > fin:
+        return None
+    return inicio, min(fin, size - 1)
+
+def strong_etag(key: str, stat: os.stat_result) -> str:
+    """El sha256 de la ruta si la clave es por contenido; si no, tamaño y mtime en ns."""
+    clave = content_key(key)
+    if clave is not None:
+        return f'"{clave}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [e.strip() for e in header.split(",")]
+
+async def open_file(path: str):
+    """Abre `path` para lectura y devuelve (archivo, stat) del archivo abierto.
+
+    Con el descriptor abierto, que otra petición u otro proceso borre la
+    ruta (p. ej. un desalojo de la caché de imágenes) ya no corta el envío.
+    """
+    f = await aiofiles.open(path, "rb")
+    try:
+        stat = await anyio.to_thread.run_sync(os.fstat, f.fileno())
+    except BaseException:
+        await f.close()
+        raise
+    return f, stat
+
+class FileRangeResponse(Response):
+    """Responde `length` bytes del archivo abierto `file` desde `offset`, leídos por chunks.
+
+    Cierra `file` al terminar. No usa la extensión `http.response.zerocopysend`:
+    los middlewares `@app.middleware("http")` de main.py son BaseHTTPMiddleware
+    y solo reenvían mensajes `http.response.body`.
+    """
+
+    def __init__(self, file, offset: int, length: int, status_code: int, headers: dict, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.length == 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await self.file.seek(self.offset)
+            restante = self.length
+            while restante > 0:
+                chunk = await self.file.read(min(MEDIA_CHUNK_SIZE, restante))
+                if not chunk:
+                    break
+                restante -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": restante > 0})
+            if restante > 0:
+                # El archivo se acortó mientras se enviaba.
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await self.file.close()
+
+async def serve_file(request: Request, key: str, path: str, cache_control: Optional[str] = None, opened=None) -> Response:
+    """GET/HEAD de un archivo local con ETag fuerte, If-None-Match, Range e If-Range.
+
+    Sin `cache_control`, las claves por contenido son inmutables y el resto se
+    revalida. `opened` es un (archivo, stat) ya abierto con `open_file`; si no
+    se pasa, se abre `path`.
+    """
+    if opened is None:
+        try:
+            opened = await open_file(path)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    f, stat = opened
+    try:
+        response = _file_response(request, key, path, f, stat, cache_control)
+    except BaseException:
+        await f.close()
+        raise
+    if not isinstance(response, FileRangeResponse):
+        await f.close()
+    return response
+
+def _file_response(request: Request, key: str, path: str, f, stat: os.stat_result, cache_control: Optional[str]) -> Response:
+    etag = strong_etag(key, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control or (IMMUTABLE_CACHE_CONTROL if content_key(key) else "no-cache"),
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    size = stat.st_size
+    rango = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            rango = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    send_body = request.method != "HEAD"
+    if rango is None:
+        headers["Content-Length"] = str(size)
+        return FileRangeResponse(f, 0, size, 200, headers, send_body)
+    inicio, fin = rango
+    headers["Content-Length"] = str(fin - inicio + 1)
+    headers["Content-Range"] = f"bytes {inicio}-{fin}/{size}"
+    return FileRangeResponse(f, inicio, fin - inicio + 1, 206, headers, send_body)
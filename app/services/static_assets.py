@@ -0,0 +1,158 @@
+import gzip
+import hashlib
+import importlib.util
+import logging
+import mimetypes
+import os
+from typing import Dict, Set, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from app.services.media import IMMUTABLE_CACHE_CONTROL
+
+# ---------------------- CONFIG ----------------------
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", ".static_build")
+STATIC_FINGERPRINT = os.getenv("STATIC_FINGERPRINT", "true").lower() in ("1", "true", "yes")
+STATIC_GZIP_LEVEL = int(os.getenv("STATIC_GZIP_LEVEL", "9"))
+STATIC_BROTLI_QUALITY = int(os.getenv("STATIC_BROTLI_QUALITY", "11"))
+# Una variante comprimida se guarda solo si ahorra al menos esta fracción.
+STATIC_MIN_SAVING = float(os.getenv("STATIC_MIN_SAVING", "0.05"))
+
+# brotli es opcional: sin él solo se generan las variantes gzip.
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+
+# Codificación -> sufijo del archivo precomprimido, en orden de preferencia.
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# Formatos ya comprimidos: gzip/brotli no les ganan casi nada y solo alargan el arranque.
+_YA_COMPRIMIDOS = {
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif",
+    "font/woff", "font/woff2", "application/zip", "application/gzip",
+}
+
+# 'css/style.css' -> 'css/style.1a2b3c4d5e6f.css'
+_manifest: Dict[str, str] = {}
+# 'css/style.1a2b3c4d5e6f.css' -> codificaciones precomprimidas disponibles
+_encoded: Dict[str, Tuple[str, ...]] = {}
+
+# ---------------------- BUILD ----------------------
+def fingerprint_name(path: str, digest: str) -> str:
+    base, ext = os.path.splitext(path)
+    return f"{base}.{digest[:12]}{ext}"
+
+def _compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        import brotli
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL, mtime=0)
+
+def _write(ruta: str, data: bytes):
+    """Escritura atómica: varios workers pueden construir el mismo archivo a la vez."""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(data)
+    os.replace(temporal, ruta)
+
+def build_static_assets(source: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR):
+    """Copia cada archivo de `source` a `build_dir` con el hash de su contenido en el
+    nombre y genera sus variantes .br/.gz; devuelve (manifest, codificaciones).
+
+    Los nombres dependen del contenido, así que en un arranque en caliente los
+    archivos ya existen y solo se recalculan los hashes.
+    """
+    manifest: Dict[str, str] = {}
+    encoded: Dict[str, Tuple[str, ...]] = {}
+    for raiz, _, nombres in os.walk(source):
+        for nombre in nombres:
+            if nombre.startswith("."):
+                continue
+            origen = os.path.join(raiz, nombre)
+            relativo = os.path.relpath(origen, source).replace(os.sep, "/")
+            with open(origen, "rb") as f:
+                data = f.read()
+            hashed = fingerprint_name(relativo, hashlib.sha256(data).hexdigest())
+            destino = os.path.join(build_dir, hashed)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            if not os.path.exists(destino):
+                _write(destino, data)
+
+            disponibles = []
+            if mimetypes.guess_type(nombre)[0] not in _YA_COMPRIMIDOS:
+                for encoding, sufijo in ENCODINGS.items():
+                    if encoding == "br" and not BROTLI_AVAILABLE:
+                        continue
+                    if not os.path.exists(destino + sufijo):
+                        comprimido = _compress(encoding, data)
+                        if len(comprimido) > len(data) * (1 - STATIC_MIN_SAVING):
+                            continue
+                        _write(destino + sufijo, comprimido)
+                    disponibles.append(encoding)
+            manifest[relativo] = hashed
+            encoded[hashed] = tuple(disponibles)
+    return manifest, encoded
+
+def load_static_assets():
+    """Construye los assets y publica el manifest para `asset_path` y FingerprintedStaticFiles."""
+    global _manifest, _encoded
+    if not STATIC_FINGERPRINT:
+        return
+    _manifest, _encoded = build_static_assets()
+    comprimidos = sum(1 for e in _encoded.values() if e)
+    logging.info(f"Assets estáticos: {len(_manifest)} con hash, {comprimidos} precomprimidos.")
+
+def asset_path(path: str) -> str:
+    """'css/style.css' -> 'css/style.<hash>.css'; sin build devuelve la ruta original."""
+    return _manifest.get(path.lstrip("/"), path)
+
+# ---------------------- SERVIR ----------------------
+def _accepted_encodings(header: str) -> Set[str]:
+    aceptadas = set()
+    for parte in header.split(","):
+        nombre, _, params = parte.partition(";")
+        q = params.replace(" ", "").lower()
+        if q.startswith("q=") and float(q[2:] or 0) == 0:
+            continue
+        aceptadas.add(nombre.strip().lower())
+    return aceptadas
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles de `static/` que además sirve los nombres con hash.
+
+    Un nombre con hash nunca cambia de contenido: se responde con
+    Cache-Control inmutable y, según Accept-Encoding, con la variante .br o
+    .gz generada al arrancar. Los nombres originales se siguen sirviendo
+    como antes (con revalidación).
+    """
+
+    def __init__(self, directory: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR):
+        super().__init__(directory=directory)
+        self.build_dir = build_dir
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        encodings = _encoded.get(path.replace(os.sep, "/"))
+        if encodings is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        try:
+            aceptadas = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        except ValueError:
+            aceptadas = set()
+        encoding = next((e for e in encodings if e in aceptadas), None)
+        full_path = os.path.join(self.build_dir, path + (ENCODINGS[encoding] if encoding else ""))
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, full_path)
+        except FileNotFoundError:
+            return await super().get_response(path, scope)
+
+        response = self.file_response(full_path, stat_result, scope)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        if encodings:
+            response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,211 @@
+import os
+import urllib.parse
+import uuid
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import AsyncIterable, Dict, List, Optional, Tuple, Union
+
+import aiofiles
+import aiofiles.os
+from dotenv import load_dotenv
+
+from app.services.storage_client import close_storage_client, get_storage_client
+
+load_dotenv()
+
+# ---------------------- CONFIG ----------------------
+# "supabase" (Supabase Storage) o "local" (disco del servidor).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "media")
+# Prefijo de las URLs públicas del backend local; lo sirve la ruta /media.
+LOCAL_STORAGE_URL = os.getenv("LOCAL_STORAGE_URL", "/media").rstrip("/")
+# Prefijo del proxy con caché en disco (ruta /img) para las imágenes remotas;
+# vacío hace que los navegadores las pidan directo al backend.
+IMAGE_PROXY_URL = os.getenv("IMAGE_PROXY_URL", "/img").rstrip("/")
+# Origen público de la app (p. ej. https://tm.example.com) para completar las
+# URLs relativas (/img, /media) que entrega la API; vacío = el de cada petición.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+# URL base de la petición en curso; la fija el middleware de main.py.
+current_base_url: ContextVar[Optional[str]] = ContextVar("current_base_url", default=None)
+
+BUCKET_BUSES = "buses"
+BUCKET_ESTACIONES = "estaciones"
+
+Content = Union[bytes, AsyncIterable[bytes]]
+
+# ---------------------- CLAVES ----------------------
+# Las filas guardan la clave '<bucket>/<ruta>', relativa al backend; la URL
+# pública se arma al responder con `image_url`.
+def make_key(bucket: str, path: str) -> str:
+    return f"{bucket}/{path}"
+
+def split_key(key: str) -> Tuple[str, str]:
+    """'buses/image/x.jpg' -> ('buses', 'image/x.jpg')."""
+    bucket, _, path = key.partition("/")
+    return bucket, path
+
+def key_from_url(valor: Optional[str]) -> Optional[str]:
+    """Clave a partir de lo guardado en una fila: una clave, una URL pública de
+    Supabase o una URL del backend local. None si es una URL externa."""
+    if not valor:
+        return None
+    if "/object/public/" in valor:
+        return urllib.parse.unquote(valor.split("/object/public/", 1)[1].split("?", 1)[0])
+    for prefijo in (LOCAL_STORAGE_URL, IMAGE_PROXY_URL):
+        if prefijo and valor.startswith(prefijo + "/"):
+            return urllib.parse.unquote(valor[len(prefijo) + 1:].split("?", 1)[0])
+    if "://" in valor:
+        return None
+    return valor
+
+def image_path(valor: Optional[str]) -> Optional[str]:
+    """URL de una clave para las plantillas; puede ser relativa al sitio (/img, /media).
+
+    Las URLs completas (externas o ya resueltas) pasan tal cual. Con un
+    backend remoto y IMAGE_PROXY_URL definido, la URL apunta al proxy /img.
+    """
+    if not valor or "://" in valor or valor.startswith("/"):
+        return valor
+    if IMAGE_PROXY_URL and STORAGE_BACKEND != "local":
+        return f"{IMAGE_PROXY_URL}/{urllib.parse.quote(valor, safe='/')}"
+    return get_storage().public_url(valor)
+
+def image_url(valor: Optional[str]) -> Optional[str]:
+    """URL absoluta de una clave para la API: `image_path` completada con PUBLIC_BASE_URL
+    o con la URL base de la petición. Fuera de una petición puede quedar relativa."""
+    url = image_path(valor)
+    if url and url.startswith("/") and not url.startswith("//"):
+        base = PUBLIC_BASE_URL or current_base_url.get()
+        if base:
+            return base + url
+    return url
+
+def image_url_prefix() -> str:
+    """Lo que `image_url` antepone a una clave, para armar la URL fuera de Python (p. ej. en SQL).
+
+    Todos los caminos de `image_url` son prefijo + clave codificada; se
+    obtiene pasando una clave de prueba que no necesita codificarse.
+    """
+    return image_url("_/_")[:-3]
+
+def variant_image_urls(variantes: Optional[Dict[str, Dict[str, str]]]) -> Optional[Dict[str, Dict[str, str]]]:
+    """`image_url` aplicado a cada variante de un dict {formato: {ancho: clave}}."""
+    if not variantes:
+        return variantes
+    return {formato: {ancho: image_url(v) for ancho, v in por_ancho.items()} for formato, por_ancho in variantes.items()}
+
+# ---------------------- BACKENDS ----------------------
+class StorageBackend(ABC):
+    """Almacenamiento de objetos direccionado por clave '<bucket>/<ruta>'.
+
+    Un backend al que le falte alguno de los métodos abstractos falla al
+    crearse (en `get_storage`), no en la primera subida o borrado.
+    """
+
+    @abstractmethod
+    async def put(self, key: str, content: Content, content_type: str, content_length: Optional[int] = None) -> None:
+        """Guarda (o reemplaza) el objeto; `content` puede ser bytes o un iterable async de chunks."""
+
+    @abstractmethod
+    async def delete(self, keys: List[str]) -> None:
+        """Borra los objetos; una clave que no existe no es un error."""
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        """URL pública del objeto en el backend."""
+
+    async def aclose(self) -> None:
+        pass
+
+class SupabaseBackend(StorageBackend):
+    """Supabase Storage a través del cliente HTTP/2 compartido (ver storage_client.py)."""
+
+    async def put(self, key: str, content: Content, content_type: str, content_length: Optional[int] = None) -> None:
+        bucket, path = split_key(key)
+        await get_storage_client().upload(
+            bucket, path, content, content_type, upsert=True, content_length=content_length
+        )
+
+    async def delete(self, keys: List[str]) -> None:
+        por_bucket: Dict[str, List[str]] = {}
+        for key in keys:
+            bucket, path = split_key(key)
+            por_bucket.setdefault(bucket, []).append(path)
+        for bucket, paths in por_bucket.items():
+            await get_storage_client().remove(bucket, paths)
+
+    def public_url(self, key: str) -> str:
+        return get_storage_client().public_url(*split_key(key))
+
+    async def aclose(self) -> None:
+        await close_storage_client()
+
+class LocalBackend(StorageBackend):
+    """Archivos bajo `root`, escritos con aiofiles y servidos por la ruta /media.
+
+    Cada escritura va a un temporal y se renombra al final, así que un
+    lector nunca ve un archivo a medias y una subida cortada no deja restos.
+    """
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, url_base: str = LOCAL_STORAGE_URL):
+        self.root = os.path.realpath(root)
+        self.url_base = url_base
+
+    def path(self, key: str) -> str:
+        """Ruta en disco de una clave; rechaza claves que salgan de `root`."""
+        ruta = os.path.realpath(os.path.join(self.root, key))
+        if not ruta.startswith(self.root + os.sep):
+            raise ValueError(f"Clave fuera del almacenamiento local: {key}")
+        return ruta
+
+    async def put(self, key: str, content: Content, content_type: str, content_length: Optional[int] = None) -> None:
+        ruta = self.path(key)
+        await aiofiles.os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        try:
+            async with aiofiles.open(temporal, "wb") as f:
+                if isinstance(content, bytes):
+                    await f.write(content)
+                else:
+                    async for chunk in content:
+                        await f.write(chunk)
+            await aiofiles.os.replace(temporal, ruta)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(temporal)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def delete(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                await aiofiles.os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def public_url(self, key: str) -> str:
+        return f"{self.url_base}/{urllib.parse.quote(key, safe='/')}"
+
+BACKENDS = {
+    "supabase": SupabaseBackend,
+    "local": LocalBackend,
+}
+
+_backend: Optional[StorageBackend] = None
+
+def get_storage() -> StorageBackend:
+    """Backend elegido con STORAGE_BACKEND, creado en el primer uso."""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND not in BACKENDS:
+            raise ValueError(f"STORAGE_BACKEND desconocido: {STORAGE_BACKEND}")
+        _backend = BACKENDS[STORAGE_BACKEND]()
+    return _backend
+
+async def close_storage():
+    global _backend
+    if _backend is not None:
+        await _backend.aclose()
+        _backend = None
@@ -0,0 +1,126 @@
+import os
+import urllib.parse
+from typing import AsyncIterable, AsyncIterator, List, Optional, Union
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------------- CONFIG ----------------------
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "10"))
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "3"))
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "20"))
+STORAGE_KEEPALIVE_EXPIRY = float(os.getenv("STORAGE_KEEPALIVE_EXPIRY", "30"))
+STORAGE_HTTP2 = os.getenv("STORAGE_HTTP2", "true").lower() in ("1", "true", "yes")
+
+class StorageError(Exception):
+    """Respuesta de error de la API de Storage."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+class StorageClient:
+    """Cliente async de la API REST de Supabase Storage.
+
+    Comparte un único httpx.AsyncClient (HTTP/2 con keep-alive) entre todas
+    las peticiones, así que subir o borrar no bloquea el event loop y no abre
+    una conexión TLS nueva cada vez.
+    """
+
+    def __init__(self, base_url: str, key: str):
+        self.base_url = base_url.rstrip("/")
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.base_url}/storage/v1",
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+            http2=STORAGE_HTTP2,
+            timeout=httpx.Timeout(STORAGE_TIMEOUT, connect=STORAGE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=STORAGE_MAX_CONNECTIONS,
+                max_keepalive_connections=STORAGE_MAX_CONNECTIONS,
+                keepalive_expiry=STORAGE_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    @staticmethod
+    def _quote(path: str) -> str:
+        return urllib.parse.quote(path, safe="/")
+
+    def public_url(self, bucket: str, path: str) -> str:
+        return f"{self.base_url}/storage/v1/object/public/{bucket}/{self._quote(path)}"
+
+    async def upload(
+        self,
+        bucket: str,
+        path: str,
+        content: Union[bytes, AsyncIterable[bytes]],
+        content_type: str,
+        upsert: bool = False,
+        timeout: Optional[float] = None,
+        content_length: Optional[int] = None,
+    ) -> str:
+        """Sube `content` (bytes o iterable async de chunks) y devuelve la URL pública.
+
+        Con un iterable y sin `content_length` el cuerpo va con chunked encoding.
+        """
+        headers = {"Content-Type": content_type, "x-upsert": "true" if upsert else "false"}
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        response = await self._client.post(
+            f"/object/{bucket}/{self._quote(path)}",
+            content=content,
+            headers=headers,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+        self._raise_for_status(response)
+        return self.public_url(bucket, path)
+
+    async def download(self, bucket: str, path: str) -> AsyncIterator[bytes]:
+        """Chunks de un objeto público, a medida que llegan (sin cargarlo entero)."""
+        async with self._client.stream("GET", f"/object/public/{bucket}/{self._quote(path)}") as response:
+            if response.status_code >= 400:
+                await response.aread()
+                self._raise_for_status(response)
+            async for chunk in response.aiter_bytes():
+                yield chunk
+
+    async def remove(self, bucket: str, paths: List[str], timeout: Optional[float] = None) -> None:
+        """Borra varias rutas de un bucket en una sola petición."""
+        response = await self._client.request(
+            "DELETE",
+            f"/object/{bucket}",
+            json={"prefixes": paths},
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+        self._raise_for_status(response)
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code >= 400:
+            raise StorageError(response.status_code, response.text[:500])
+
+    async def aclose(self):
+        await self._client.aclose()
+
+_client: Optional[StorageClient] = None
+
+def get_storage_client() -> StorageClient:
+    """Cliente compartido, creado en el primer uso."""
+    global _client
+    if _client is None:
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_KEY")
+        if not url:
+            raise ValueError("La variable de entorno SUPABASE_URL no está definida")
+        if not key:
+            raise ValueError("La variable de entorno SUPABASE_KEY no está definida")
+        _client = StorageClient(url, key)
+    return _client
+
+async def close_storage_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,79 +1,212 @@
+import asyncio
+import hashlib
+import logging
 import os
-import uuid
-from fastapi import UploadFile
-from dotenv import load_dotenv
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional
 import aiofiles
-from supabase import create_client
+import aiofiles.os
+from fastapi import UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import new_session
+from app.operations.imagenes import reclamar_borrables, tomar_imagen
+from app.services import images
+from app.services.storage import get_storage, key_from_url, make_key
 
-load_dotenv()
+# ---------------------- SUBIDAS ----------------------
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Directorio de la copia en disco que leen los procesos de variantes; vacío = el temporal del sistema.
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+class UploadRejected(Exception):
+    """Subida rechazada antes de terminar (tamaño o tipo)."""
 
-if not SUPABASE_URL:
-    raise ValueError("La variable de entorno SUPABASE_URL no está definida")
-if not SUPABASE_KEY:
-    raise ValueError("La variable de entorno SUPABASE_KEY no está definida")
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+_FIRMAS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
 
-async def upload_file(file: UploadFile, filename: str, bucket_name: str):
-    """Sube un archivo a un bucket específico en Supabase Storage."""
-    content = await file.read()
-    file_path = f"image/{filename}"
+def sniff_image_type(cabecera: bytes) -> Optional[str]:
+    """Tipo de imagen según los primeros bytes (magic bytes), o None si no es una imagen conocida."""
+    for firma, tipo in _FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if cabecera[4:8] == b"ftyp" and cabecera[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return None
 
-    try:
-        res = supabase.storage.from_(bucket_name).upload(
-            file_path,
-            content,
-            {"content-type": file.content_type}
-        )
-        public_url_response = supabase.storage.from_(bucket_name).get_public_url(file_path)
-        return {"url": public_url_response}
-    except Exception as e:
-        print(f"Error al subir imagen a Supabase Storage en el bucket {bucket_name}: {e}")
-        return {"error": str(e)}
+def _too_large() -> UploadRejected:
+    return UploadRejected(413, f"La imagen supera el máximo de {UPLOAD_MAX_BYTES} bytes")
+
+async def _chunks(file: UploadFile, primero: bytes) -> AsyncIterator[bytes]:
+    """Lee el spool del UploadFile de a UPLOAD_CHUNK_SIZE, cortando al pasar el límite."""
+    total = len(primero)
+    yield primero
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        total += len(chunk)
+        if total > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        yield chunk
+
+_EXTENSIONES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/avif": "avif",
+}
 
-async def save_file(file: UploadFile, to_supabase: bool, bucket_name: str):
+def content_path(sha256: str, content_type: str) -> str:
+    """Ruta direccionada por contenido: 'image/sha256/<hex>.<ext>'."""
+    return f"image/sha256/{sha256}.{_EXTENSIONES[content_type]}"
+
+async def _hash_spool(file: UploadFile, primero: bytes, copia: Optional[str] = None) -> str:
+    """sha256 del archivo leyendo el spool por chunks (sin cargarlo entero) y cortando al pasar el límite.
+
+    Con `copia`, los mismos chunks se escriben en ese archivo para que el
+    pool de variantes lo abra por ruta.
     """
-    Guarda un archivo, ya sea localmente o en Supabase, y devuelve la URL o ruta.
-    Ahora acepta bucket_name para especificar dónde subir en Supabase.
+    h = hashlib.sha256()
+    if copia is None:
+        async for chunk in _chunks(file, primero):
+            h.update(chunk)
+        return h.hexdigest()
+    async with aiofiles.open(copia, "wb") as f:
+        async for chunk in _chunks(file, primero):
+            h.update(chunk)
+            await f.write(chunk)
+    return h.hexdigest()
+
+def _temp_path() -> str:
+    fd, ruta = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_TMP_DIR)
+    os.close(fd)
+    return ruta
+
+async def upload_file(file: UploadFile, bucket_name: str, session: AsyncSession):
+    """Guarda un archivo en un bucket del backend de almacenamiento (ver storage.py).
+
+    El contenido se transmite por chunks desde el archivo temporal de la
+    petición, así que la memoria por subida queda acotada por
+    UPLOAD_CHUNK_SIZE. El tipo se verifica con los magic bytes del primer
+    chunk y la subida se corta en cuanto se pasa UPLOAD_MAX_BYTES. Los
+    rechazos devuelven {"error", "status_code"}.
+
+    El objeto se guarda bajo su sha256: si el bucket ya tiene esa imagen no
+    se vuelve a subir (ni a generar variantes), se devuelve la clave
+    existente y su referencia ya queda tomada en la transacción de
+    `session` ("retenida"). El resultado trae "key" (lo que se guarda en la
+    fila), "sha256" y "bucket" para `registrar_imagen`, que debe llamarse
+    en esa misma transacción.
     """
-    if not file.content_type.startswith("image/"):
-        return {"error": "Solo se permiten imágenes"}
+    copia = None
+    try:
+        tamano = getattr(file, "size", None)
+        if tamano is not None and tamano > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        await file.seek(0)
+        primero = await file.read(UPLOAD_CHUNK_SIZE)
+        if len(primero) > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        content_type = sniff_image_type(primero)
+        if content_type is None:
+            raise UploadRejected(415, "Solo se permiten imágenes")
 
-    new_filename = f"{uuid.uuid4().hex}_{file.filename}"
+        if images.variants_enabled():
+            copia = await asyncio.to_thread(_temp_path)
+        sha256 = await _hash_spool(file, primero, copia)
+        existente = await tomar_imagen(session, bucket_name, sha256)
+        if existente is not None:
+            return {**existente, "sha256": sha256, "bucket": bucket_name, "retenida": True}
 
-    if to_supabase:
-        return await upload_file(file, new_filename, bucket_name)
-    else:
+        key = make_key(bucket_name, content_path(sha256, content_type))
+        await file.seek(0)
+        primero = await file.read(UPLOAD_CHUNK_SIZE)
+        # Los backends reemplazan: dos subidas simultáneas de la misma imagen escriben los mismos bytes.
+        await get_storage().put(key, _chunks(file, primero), content_type, content_length=tamano)
+        resultado = {"key": key, "sha256": sha256, "bucket": bucket_name}
+        if copia is not None:
+            resultado["variantes"] = await upload_variants(copia, key)
+        return resultado
+    except UploadRejected as e:
+        return {"error": e.detail, "status_code": e.status_code}
+    except Exception as e:
+        print(f"Error al guardar imagen en el bucket {bucket_name}: {e}")
+        return {"error": str(e)}
+    finally:
+        if copia is not None:
+            try:
+                await aiofiles.os.remove(copia)
+            except FileNotFoundError:
+                pass
 
-        return {"error": "Guardado local no implementado para este contexto"}
+async def upload_variants(path: str, key: str) -> Optional[Dict[str, Dict[str, str]]]:
+    """Genera las variantes del archivo `path` en el pool de procesos y las guarda junto al original.
 
-async def delete_file(file_url: str, bucket_name: str) -> bool:
-   
+    Al pool solo viaja la ruta, no los bytes de la imagen. Devuelve
+    {formato: {ancho: clave}}; si algo falla se registra y se sigue solo
+    con el original.
+    """
     try:
+        variantes = await images.generate_variants(path)
+        claves = [images.variant_path(key, ancho, formato) for formato, ancho, _ in variantes]
+        await asyncio.gather(*(
+            get_storage().put(clave, contenido, images.VARIANT_FORMATS[formato][1])
+            for clave, (formato, _, contenido) in zip(claves, variantes)
+        ))
+        resultado: Dict[str, Dict[str, str]] = {}
+        for (formato, ancho, _), clave in zip(variantes, claves):
+            resultado.setdefault(formato, {})[str(ancho)] = clave
+        return resultado or None
+    except Exception as e:
+        logging.error(f"Error al generar variantes de {key}: {e}")
+        return None
+
+async def save_file(file: UploadFile, bucket_name: str, session: AsyncSession):
+    """
+    Guarda un archivo en el backend configurado (STORAGE_BACKEND) y devuelve su clave.
+    Si la imagen se rechaza, el dict de error trae también "status_code" (413/415).
+    Con Pillow instalado el resultado incluye "variantes": {formato: {ancho: clave}}.
+    Las imágenes repetidas se guardan una sola vez (ver `upload_file`); `session`
+    es la transacción en la que se guardará la fila que usa la imagen.
+    """
+    return await upload_file(file, bucket_name, session)
 
-        path_in_bucket = get_supabase_path_from_url(file_url, bucket_name)
-        if not path_in_bucket:
-            print(f"No se pudo extraer la ruta del archivo de la URL: {file_url}")
-            return False
-
-        res = supabase.storage.from_(bucket_name).remove([path_in_bucket])
-        if res and not res[0].get('error'): 
-            print(f"Archivo {path_in_bucket} eliminado exitosamente del bucket {bucket_name}.")
-            return True
-        else:
-            print(f"Error al eliminar el archivo {path_in_bucket} del bucket {bucket_name}: {res}")
-            return False
+async def delete_file(valor: str) -> bool:
+    """Borra un archivo a partir de su clave (o URL pública); False si no se pudo o sigue en uso."""
+    key = key_from_url(valor)
+    if not key:
+        print(f"No se pudo extraer la clave del archivo de: {valor}")
+        return False
+    try:
+        async with new_session() as session:
+            if key not in await reclamar_borrables(session, [key]):
+                print(f"Archivo {key} aún referenciado; no se elimina.")
+                return False
+            await get_storage().delete([key])
+            await session.commit()
+        print(f"Archivo {key} eliminado exitosamente.")
+        return True
     except Exception as e:
-        print(f"Excepción al intentar eliminar archivo de Supabase Storage: {e}")
+        print(f"Excepción al intentar eliminar el archivo {key}: {e}")
         return False
 
-def get_supabase_path_from_url(url: str, bucket_name: str) -> str:
-    """Extrae la ruta del archivo dentro del bucket de una URL pública de Supabase."""
-    parts = url.split(f"/public/{bucket_name}/")
-    if len(parts) > 1:
-        import urllib.parse
-        return urllib.parse.unquote(parts[-1])
-    return ""
\ No newline at end of file
+async def remove_files(keys: List[str]) -> None:
+    """Elimina varias claves del backend.
+
+    A diferencia de `delete_file`, propaga los errores para que la cola de
+    trabajos pueda reintentar.
+    """
+    await get_storage().delete(keys)
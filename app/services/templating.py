@@ -0,0 +1,27 @@
+import os
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, pass_context
+from app.services.static_assets import asset_path
+from app.services.storage import image_path
+
+# Caché en disco del bytecode compilado de las plantillas: los workers nuevos
+# cargan el bytecode en vez de volver a parsear cada plantilla.
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", ".jinja_cache")
+
+templates = Jinja2Templates(directory="templates")
+
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Las filas guardan claves del backend de almacenamiento: {{ bus.imagen | image_url }}.
+# En el HTML basta la ruta relativa al sitio.
+templates.env.filters["image_url"] = image_path
+
+@pass_context
+def url_for(context: dict, name: str, /, **path_params):
+    """El url_for de Starlette, pero url_for('static', path=...) apunta al nombre con hash."""
+    if name == "static" and "path" in path_params:
+        path_params["path"] = asset_path(path_params["path"])
+    return context["request"].url_for(name, **path_params)
+
+templates.env.globals["url_for"] = url_for
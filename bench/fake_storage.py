@@ -0,0 +1,74 @@
+"""Servidor local que imita la API de Supabase Storage para trabajar sin red.
+
+Uso:
+    python -m bench.fake_storage [--port 9000] [--dir /tmp/fake_storage] [--latency-ms 0]
+
+Y en la aplicación:
+    SUPABASE_URL=http://127.0.0.1:9000 SUPABASE_KEY=local uvicorn main:app
+
+Implementa lo que usa `app/services/storage_client.py`: subir
+(POST /storage/v1/object/{bucket}/{ruta}), borrar en lote
+(DELETE /storage/v1/object/{bucket} con {"prefixes": [...]}) y leer la URL
+pública (GET /storage/v1/object/public/{bucket}/{ruta}). Los objetos se
+guardan como archivos bajo --dir. Con --latency-ms se simula la latencia de
+red para comprobar que las subidas no bloquean el event loop.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+app = FastAPI()
+STORAGE_DIR = os.path.join(tempfile.gettempdir(), "fake_storage")
+LATENCY_S = 0.0
+
+def _ruta(bucket: str, path: str) -> str:
+    destino = os.path.realpath(os.path.join(STORAGE_DIR, bucket, path))
+    if not destino.startswith(os.path.realpath(STORAGE_DIR) + os.sep):
+        raise HTTPException(status_code=400, detail="Ruta inválida")
+    return destino
+
+@app.post("/storage/v1/object/{bucket}/{path:path}")
+async def subir(bucket: str, path: str, request: Request):
+    await asyncio.sleep(LATENCY_S)
+    destino = _ruta(bucket, path)
+    if os.path.exists(destino) and request.headers.get("x-upsert") != "true":
+        raise HTTPException(status_code=409, detail="The resource already exists")
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    with open(destino, "wb") as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+    return {"Key": f"{bucket}/{path}"}
+
+@app.delete("/storage/v1/object/{bucket}")
+async def borrar(bucket: str, request: Request):
+    await asyncio.sleep(LATENCY_S)
+    borrados = []
+    for path in (await request.json()).get("prefixes", []):
+        destino = _ruta(bucket, path)
+        if os.path.exists(destino):
+            os.remove(destino)
+            borrados.append({"name": path})
+    return borrados
+
+@app.get("/storage/v1/object/public/{bucket}/{path:path}")
+async def leer(bucket: str, path: str):
+    destino = _ruta(bucket, path)
+    if not os.path.isfile(destino):
+        raise HTTPException(status_code=404, detail="Object not found")
+    return FileResponse(destino)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--dir", default=STORAGE_DIR)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    STORAGE_DIR = args.dir
+    LATENCY_S = args.latency_ms / 1000
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,91 @@
+"""Benchmark de índices: plan de ejecución de los filtros de listado antes y después.
+
+Uso:
+    DATABASE_URL=postgresql://... python bench/index_bench.py [--rows 2000000]
+
+Crea las tablas sintéticas `bench_buses` y `bench_estaciones` en la base
+indicada (usar una base de pruebas), mide las consultas que genera
+`crud.obtener_buses` / `crud.obtener_estaciones` sin índices, crea los mismos
+índices que la migración 0002 y vuelve a medir. Las tablas se eliminan al final.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import asyncpg
+
+SETUP = [
+    "DROP TABLE IF EXISTS bench_buses",
+    "DROP TABLE IF EXISTS bench_estaciones",
+    """CREATE TABLE bench_buses AS
+       SELECT g AS id, 'bus-' || g AS nombre_bus,
+              CASE WHEN g % 3 = 0 THEN 'troncal' ELSE 'zonal' END AS tipo,
+              (g % 10 <> 0) AS activo, NULL::varchar AS imagen
+       FROM generate_series(1, $ROWS) g""",
+    """CREATE TABLE bench_estaciones AS
+       SELECT g AS id, 'estacion-' || g AS nombre_estacion,
+              (ARRAY['Usaquén','Chapinero','Santa Fe','San Cristóbal','Usme','Tunjuelito',
+                     'Bosa','Kennedy','Fontibón','Engativá','Suba','Barrios Unidos',
+                     'Teusaquillo','Los Mártires','Antonio Nariño','Puente Aranda',
+                     'La Candelaria','Rafael Uribe Uribe','Ciudad Bolívar','Sumapaz'])[1 + g % 20]
+                || ' sector ' || (g % 5000) AS localidad,
+              'B74,K86' AS rutas_asociadas, (g % 10 <> 0) AS activo, NULL::varchar AS imagen
+       FROM generate_series(1, $ROWS) g""",
+    "ALTER TABLE bench_buses ADD PRIMARY KEY (id)",
+    "ALTER TABLE bench_estaciones ADD PRIMARY KEY (id)",
+]
+
+INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ON bench_buses (tipo, activo)",
+    "CREATE INDEX ON bench_buses (tipo, id) WHERE activo",
+    "CREATE INDEX ON bench_estaciones (id) WHERE activo",
+    "CREATE INDEX ON bench_estaciones USING gin (lower(localidad) gin_trgm_ops)",
+]
+
+QUERIES = [
+    ("buses tipo+activo", "SELECT * FROM bench_buses WHERE tipo = $1 AND activo = $2", ("troncal", False)),
+    ("buses activos por tipo", "SELECT * FROM bench_buses WHERE tipo = $1 AND activo = $2", ("zonal", True)),
+    ("estaciones localidad LIKE", "SELECT * FROM bench_estaciones WHERE lower(localidad) LIKE $1", ("%sector 4242%",)),
+]
+
+async def explicar(conn, sql, args):
+    plan = await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", *args)
+    plan = json.loads(plan)[0]
+    nodo = plan["Plan"]
+    tipos = []
+    while nodo:
+        tipos.append(nodo["Node Type"] + (f" ({nodo['Index Name']})" if "Index Name" in nodo else ""))
+        nodo = (nodo.get("Plans") or [None])[0]
+    return " -> ".join(tipos), plan["Execution Time"]
+
+async def medir(conn, etiqueta):
+    print(f"\n== {etiqueta} ==")
+    for nombre, sql, args in QUERIES:
+        plan, ms = await explicar(conn, sql, args)
+        print(f"{nombre:28s} {ms:10.2f} ms  {plan}")
+
+async def main(rows: int):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        inicio = time.perf_counter()
+        for sql in SETUP:
+            await conn.execute(sql.replace("$ROWS", str(rows)))
+        await conn.execute("ANALYZE bench_buses; ANALYZE bench_estaciones")
+        print(f"{rows} filas sintéticas por tabla en {time.perf_counter() - inicio:.1f}s")
+
+        await medir(conn, "sin índices")
+        for sql in INDEXES:
+            await conn.execute(sql)
+        await conn.execute("ANALYZE bench_buses; ANALYZE bench_estaciones")
+        await medir(conn, "con índices de la migración 0002")
+    finally:
+        await conn.execute("DROP TABLE IF EXISTS bench_buses; DROP TABLE IF EXISTS bench_estaciones")
+        await conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    asyncio.run(main(parser.parse_args().rows))
@@ -0,0 +1,96 @@
+"""Benchmark de escrituras: idas a la base y latencia p50/p99 antes y después de RETURNING.
+
+Uso:
+    DATABASE_URL=postgresql://... python -m bench.write_bench [--ops 500]
+
+Usa las tablas reales (aplica las migraciones si hace falta), así que debe
+apuntar a una base de pruebas. Compara el camino anterior
+(SELECT -> modificar -> COMMIT -> refresh) con las funciones actuales de
+`crud`, que hacen un solo INSERT/UPDATE ... RETURNING. Las idas se cuentan con
+eventos del engine: BEGIN, cada sentencia y COMMIT. Los buses creados se
+eliminan al final.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import delete, event, select
+
+from app.database.db import get_async_engine, new_session, dispose_engines
+from app.database.migrations import run_migrations
+from app.models.models import Bus
+from app.operations import crud
+
+PREFIJO = "bench-write-"
+
+class ContadorIdas:
+    def __init__(self, engine):
+        self.total = 0
+        sync_engine = engine.sync_engine
+        for nombre in ("begin", "commit", "rollback", "before_cursor_execute"):
+            event.listen(sync_engine, nombre, self._contar)
+
+    def _contar(self, *args, **kwargs):
+        self.total += 1
+
+# ---------------------- CAMINO ANTERIOR ----------------------
+async def crear_bus_antes(session, nombre_bus, tipo, activo):
+    bus = Bus(nombre_bus=nombre_bus, tipo=tipo, activo=activo, imagen=None)
+    crud.sync_bus_normalized(bus)
+    session.add(bus)
+    await session.commit()
+    await session.refresh(bus)
+    return bus
+
+async def actualizar_estado_bus_antes(session, bus_id, nuevo_estado):
+    result = await session.execute(select(Bus).where(Bus.id == bus_id))
+    bus = result.scalar_one_or_none()
+    if not bus:
+        return None
+    bus.activo = nuevo_estado
+    await session.commit()
+    await session.refresh(bus)
+    return bus
+
+CASOS = [
+    ("crear_bus", "antes", lambda s, i, _: crear_bus_antes(s, f"{PREFIJO}{i}", "zonal", True)),
+    ("crear_bus", "después", lambda s, i, _: crud.crear_bus(s, f"{PREFIJO}{i}", "zonal", True)),
+    ("actualizar_estado_bus", "antes", lambda s, i, bus_id: actualizar_estado_bus_antes(s, bus_id, i % 2 == 0)),
+    ("actualizar_estado_bus", "después", lambda s, i, bus_id: crud.actualizar_estado_bus(s, bus_id, i % 2 == 0)),
+]
+
+async def medir(contador, operacion, ops, bus_id):
+    tiempos = []
+    idas_antes = contador.total
+    for i in range(ops):
+        async with new_session() as session:
+            inicio = time.perf_counter()
+            await operacion(session, i, bus_id)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    idas = (contador.total - idas_antes) / ops
+    percentiles = statistics.quantiles(tiempos, n=100)
+    return idas, percentiles[49], percentiles[98]
+
+async def main(ops: int):
+    engine = get_async_engine()
+    await run_migrations(engine)
+    contador = ContadorIdas(engine)
+    try:
+        async with new_session() as session:
+            bus_id = (await crud.crear_bus(session, f"{PREFIJO}objetivo", "troncal", True)).id
+
+        print(f"{'operación':24s} {'camino':8s} {'idas/op':>8s} {'p50 ms':>9s} {'p99 ms':>9s}")
+        for nombre, camino, operacion in CASOS:
+            idas, p50, p99 = await medir(contador, operacion, ops, bus_id)
+            print(f"{nombre:24s} {camino:8s} {idas:8.1f} {p50:9.2f} {p99:9.2f}")
+    finally:
+        async with new_session() as session:
+            await session.execute(delete(Bus.__table__).where(Bus.nombre_bus.like(f"{PREFIJO}%")))
+            await session.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=500)
+    asyncio.run(main(parser.parse_args().ops))
@@ -1,26 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File, Form, status
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from pydantic import BaseModel
 from app.operations import crud
+from app.operations.query_cache import cache_stats
+from app.operations.bulk import parse_bulk_body, unique_ids, validate_rows
+from app.operations import export, historial
+from app.operations.streaming import STREAM_MEDIA_TYPES, stream_models
+from app.operations.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, split_page, set_next_cursor
 from app import models 
-from app.schemas.schemas import Bus as BusSchema, Estacion as EstacionSchema, BusResponse, EstacionResponse
-from app.schemas.schemas import BusUpdateForm, EstacionUpdateForm, BusCreateForm, EstacionCreateForm
-from app.database.db import get_async_db 
+from app.schemas.schemas import Bus as BusSchema, Estacion as EstacionSchema, BusResponse, EstacionResponse, RutaResponse
+from app.schemas.schemas import BusUpdateForm, EstacionUpdateForm, BusCreateForm, EstacionCreateForm, BusCreate, EstacionCreate, IdsRequest
+from app.database.db import get_async_db, get_async_read_db, read_session, get_pool_status, get_replica_status
 from app.services.update_functions import actualizar_estacion_db_form, actualizar_bus_db_form
+from app.services.jobs import job_status
+from app.services.image_cache import get_image_cache
+from app.services.media import IMMUTABLE_CACHE_CONTROL, serve_file
+from app.services.storage import BUCKET_BUSES, BUCKET_ESTACIONES, LocalBackend, get_storage, split_key
+from app.services.storage_client import StorageError
 import logging
 from datetime import datetime
-from fastapi.templating import Jinja2Templates
+from app.services.templating import templates
 
 router = APIRouter()
 
 
-templates = Jinja2Templates(directory="templates")
-
-historial_eliminados = []
-
-
 # -------------------- HTML ROUTES --------------------
 
 @router.get("/", response_class=HTMLResponse, include_in_schema=False)
@@ -32,7 +37,7 @@ async def create_html(request: Request):
     return templates.TemplateResponse("CreatePage.html", {"request": request}) 
 
 @router.get("/update", response_class=HTMLResponse, tags=["HTML Pages"])
-async def update_html(request: Request, session: AsyncSession = Depends(get_async_db)):
+async def update_html(request: Request, session: AsyncSession = Depends(get_async_read_db)):
     bus_ids = await crud.get_all_bus_ids(session)
     estacion_ids = await crud.get_all_estacion_ids(session)
     if bus_ids is None:
@@ -46,14 +51,12 @@ async def delete_html(request: Request):
     return templates.TemplateResponse("DeletePage.html", {"request": request}) 
 
 @router.get("/read", response_class=HTMLResponse, tags=["HTML Pages"])
-async def read_html(request: Request, session: AsyncSession = Depends(get_async_db)):
-    """Muestra una página HTML con la lista de buses y estaciones."""
-    buses = await crud.obtener_buses(session)
-    estaciones = await crud.obtener_estaciones(session)
-    return templates.TemplateResponse(
-        "ReadPage.html", 
-        {"request": request, "buses": buses, "estaciones": estaciones}
-    )
+async def read_html(request: Request):
+    """Muestra una página HTML con la lista de buses y estaciones.
+
+    La página carga los registros por páginas desde /buses y /estaciones.
+    """
+    return templates.TemplateResponse("ReadPage.html", {"request": request})
 
 @router.get("/informacion-del-proyecto", response_class=HTMLResponse, tags=["HTML Pages"])
 async def project_info_html(request: Request):
@@ -81,7 +84,7 @@ async def historial_html(request: Request):
     return templates.TemplateResponse("HistorialPage.html", {"request": request})
 
 @router.get("/edit-bus/{bus_id}", response_class=HTMLResponse, tags=["HTML Pages"])
-async def edit_bus_html(request: Request, bus_id: int, session: AsyncSession = Depends(get_async_db)):
+async def edit_bus_html(request: Request, bus_id: int, session: AsyncSession = Depends(get_async_read_db)):
     """Muestra la página de edición unificada para un bus específico."""
     buses = await crud.obtener_buses(session, bus_id=bus_id) # Usa obtener_buses
     bus = buses[0] if buses else None # Obtiene el primer bus si existe
@@ -102,7 +105,7 @@ async def edit_redirect(request: Request, bus_id: int = None, estacion_id: int =
         raise HTTPException(status_code=400, detail="Se requiere el parámetro bus_id o estacion_id")
 
 @router.get("/edit-estacion/{estacion_id}", response_class=HTMLResponse, tags=["HTML Pages"])
-async def edit_estacion_html(request: Request, estacion_id: int, session: AsyncSession = Depends(get_async_db)):
+async def edit_estacion_html(request: Request, estacion_id: int, session: AsyncSession = Depends(get_async_read_db)):
     """Muestra la página de edición unificada para una estación específica."""
     estaciones = await crud.obtener_estaciones(session, estacion_id=estacion_id)
     estacion = estaciones[0] if estaciones else None 
@@ -122,25 +125,64 @@ async def edit_estacion_redirect(request: Request, estacion_id: int = None):
 # -------------------- BUS API --------------------
 @router.get("/buses", response_model=List[BusResponse], tags=["Buses API"])
 async def get_buses_api(
+    request: Request,
+    response: Response,
     bus_id: Optional[int] = None,
     tipo: Optional[str] = None,
     activo: Optional[bool] = None,
-    session: AsyncSession = Depends(get_async_db)
+    nombre: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_db)
 ):
-    buses = await crud.obtener_buses(session, bus_id, tipo, activo)
-    return [BusResponse.from_orm(bus) for bus in buses]
+    """Buses por páginas ordenadas por id; el cursor siguiente va en X-Next-Cursor."""
+    buses = await crud.obtener_buses(
+        session, bus_id, tipo, activo, nombre, after_id=decode_cursor(cursor), limit=limit + 1
+    )
+    pagina, siguiente = split_page(buses, limit)
+    set_next_cursor(response, request.url, siguiente)
+    return [BusResponse.from_orm(bus) for bus in pagina]
+
+@router.get("/buses/stream", tags=["Buses API"])
+async def stream_buses_api(
+    request: Request,
+    bus_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    formato: str = Query("ndjson", alias="format", pattern="^(ndjson|json)$")
+):
+    """Todos los buses que cumplen los filtros, en NDJSON o arreglo JSON por partes."""
+    cookies = dict(request.cookies)
+    return StreamingResponse(
+        stream_models(
+            lambda: read_session(cookies),
+            lambda session: crud.stream_buses(session, bus_id, tipo, activo, nombre),
+            BusResponse,
+            formato,
+        ),
+        media_type=STREAM_MEDIA_TYPES[formato],
+    )
 
 @router.get("/buses/ids", response_model=List[int], tags=["Buses API"])
-async def get_bus_ids_api(session: AsyncSession = Depends(get_async_db)):
+async def get_bus_ids_api(session: AsyncSession = Depends(get_async_read_db)):
     """Devuelve una lista de IDs de todos los buses."""
     ids = await crud.get_all_bus_ids(session)
     return ids
 
 @router.get("/buses/details", response_model=List[BusResponse], tags=["Buses API"])
-async def get_bus_details_api(session: AsyncSession = Depends(get_async_db)):
-    """Devuelve una lista de buses con detalles para la selección de eliminación."""
-    buses = await crud.obtener_buses(session)
-    return [BusResponse.from_orm(bus) for bus in buses]
+async def get_bus_details_api(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_db)
+):
+    """Devuelve una página de buses con detalles para la selección de eliminación."""
+    buses = await crud.obtener_buses(session, after_id=decode_cursor(cursor), limit=limit + 1)
+    pagina, siguiente = split_page(buses, limit)
+    set_next_cursor(response, request.url, siguiente)
+    return [BusResponse.from_orm(bus) for bus in pagina]
 
 
 @router.post("/buses", status_code=status.HTTP_201_CREATED, tags=["Buses API"])
@@ -159,28 +201,40 @@ async def create_bus_api(
         raise HTTPException(status_code=400, detail="Error al crear bus")
     return {"mensaje": "Bus insertado correctamente"}
 
+@router.post("/buses/bulk", tags=["Buses API"])
+async def create_buses_bulk_api(request: Request, session: AsyncSession = Depends(get_async_db)):
+    """Crea muchos buses en una transacción a partir de JSON, NDJSON o CSV."""
+    filas = parse_bulk_body(request.headers.get("content-type"), await request.body())
+    validas, resultados = validate_rows(filas, BusCreate)
+    try:
+        ids = await crud.crear_buses_lote(session, [bus for _, bus in validas])
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"Error en carga masiva de buses: {e}")
+        raise HTTPException(status_code=400, detail="Error al crear buses")
+    resultados += [{"fila": i, "estado": "creado", "id": bus_id} for (i, _), bus_id in zip(validas, ids)]
+    resultados.sort(key=lambda r: r["fila"])
+    return {"creados": len(ids), "rechazados": len(resultados) - len(ids), "resultados": resultados}
+
+@router.delete("/buses", tags=["Buses API"])
+async def delete_buses_bulk_api(payload: IdsRequest, session: AsyncSession = Depends(get_async_db)):
+    """Elimina varios buses con una sola sentencia e informa los ids que no existían."""
+    ids = unique_ids(payload.ids)
+    eliminados = await crud.eliminar_buses_lote(session, ids)
+    encontrados = {bus.id for bus in eliminados}
+    return {
+        "eliminados": [i for i in ids if i in encontrados],
+        "no_encontrados": [i for i in ids if i not in encontrados],
+    }
+
 @router.delete("/buses/{bus_id}", tags=["Buses API"])
 async def delete_bus_api(
     bus_id: int,
     session: AsyncSession = Depends(get_async_db)
 ):
-    bus_to_delete_list = await crud.obtener_buses(session, bus_id=bus_id)
-    if not bus_to_delete_list:
+    if not await crud.eliminar_bus(session, bus_id):
         raise HTTPException(status_code=404, detail="Bus no encontrado")
-
-    bus_obj = bus_to_delete_list[0]
-
-    resultado = await crud.eliminar_bus(session, bus_id) # Pasa la sesión
-    if not resultado:
-        raise HTTPException(status_code=404, detail="Error al eliminar el bus")
-
-    historial_eliminados.append({
-        "tipo": "bus",
-        "id": bus_obj.id,
-        "nombre_bus": bus_obj.nombre_bus,
-        "tipo_bus": bus_obj.tipo,
-        "fecha_hora": datetime.now().isoformat()
-    })
     return {"mensaje": "Bus eliminado"}
 
 @router.post("/buses/update/{bus_id}", tags=["Buses API"])
@@ -196,27 +250,74 @@ async def actualizar_bus_post(
 # -------------------- ESTACION API --------------------
 @router.get("/estaciones", response_model=List[EstacionResponse], tags=["Estaciones API"])
 async def get_estaciones_api(
+    request: Request,
+    response: Response,
     estacion_id: Optional[int] = None,
     localidad: Optional[str] = None,
     activo: Optional[bool] = None,
-    session: AsyncSession = Depends(get_async_db)
+    nombre: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_db)
+):
+    """Estaciones por páginas ordenadas por id; el cursor siguiente va en X-Next-Cursor."""
+    estaciones = await crud.obtener_estaciones(
+        session, estacion_id, localidad, activo, nombre, after_id=decode_cursor(cursor), limit=limit + 1
+    )
+    pagina, siguiente = split_page(estaciones, limit)
+    set_next_cursor(response, request.url, siguiente)
+    return [EstacionResponse.from_orm(estacion) for estacion in pagina]
+
+@router.get("/estaciones/stream", tags=["Estaciones API"])
+async def stream_estaciones_api(
+    request: Request,
+    estacion_id: Optional[int] = None,
+    localidad: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    formato: str = Query("ndjson", alias="format", pattern="^(ndjson|json)$")
 ):
-    estaciones = await crud.obtener_estaciones(session, estacion_id, localidad, activo)
-    return [EstacionResponse.from_orm(estacion) for estacion in estaciones]
+    """Todas las estaciones que cumplen los filtros, en NDJSON o arreglo JSON por partes."""
+    cookies = dict(request.cookies)
+    return StreamingResponse(
+        stream_models(
+            lambda: read_session(cookies),
+            lambda session: crud.stream_estaciones(session, estacion_id, localidad, activo, nombre),
+            EstacionResponse,
+            formato,
+        ),
+        media_type=STREAM_MEDIA_TYPES[formato],
+    )
 
 @router.get("/estaciones/ids", response_model=List[int], tags=["Estaciones API"])
-async def get_estacion_ids_api(session: AsyncSession = Depends(get_async_db)):
+async def get_estacion_ids_api(session: AsyncSession = Depends(get_async_read_db)):
     """Devuelve una lista de IDs de todas las estaciones."""
     ids = await crud.get_all_estacion_ids(session)
     if ids is None:
         return []
     return ids
 
+@router.get("/estaciones/{estacion_id}/rutas", response_model=List[RutaResponse], tags=["Estaciones API"])
+async def get_rutas_de_estacion_api(estacion_id: int, session: AsyncSession = Depends(get_async_read_db)):
+    """Rutas que paran en una estación."""
+    estacion = await crud.obtener_rutas_por_estacion(session, estacion_id)
+    if not estacion:
+        raise HTTPException(status_code=404, detail="Estación no encontrada")
+    return [RutaResponse.from_orm(ruta) for ruta in estacion.rutas]
+
 @router.get("/estaciones/details", response_model=List[EstacionResponse], tags=["Estaciones API"])
-async def get_estacion_details_api(session: AsyncSession = Depends(get_async_db)):
-    """Devuelve una lista de estaciones con detalles para la selección de eliminación."""
-    estaciones = await crud.obtener_estaciones(session)
-    return [EstacionResponse.from_orm(estacion) for estacion in estaciones]
+async def get_estacion_details_api(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_db)
+):
+    """Devuelve una página de estaciones con detalles para la selección de eliminación."""
+    estaciones = await crud.obtener_estaciones(session, after_id=decode_cursor(cursor), limit=limit + 1)
+    pagina, siguiente = split_page(estaciones, limit)
+    set_next_cursor(response, request.url, siguiente)
+    return [EstacionResponse.from_orm(estacion) for estacion in pagina]
 
 
 @router.post("/estaciones", response_model=EstacionResponse, status_code=status.HTTP_201_CREATED, tags=["Estaciones API"])
@@ -234,30 +335,53 @@ async def create_estacion_api(
     )
     if not new_estacion:
         raise HTTPException(status_code=400, detail="Error al crear estación")
-    return EstacionResponse.from_orm(new_estacion)
+    return new_estacion
+
+@router.post("/estaciones/bulk", tags=["Estaciones API"])
+async def create_estaciones_bulk_api(request: Request, session: AsyncSession = Depends(get_async_db)):
+    """Crea muchas estaciones en una transacción; los nombres repetidos se informan sin abortar el lote."""
+    filas = parse_bulk_body(request.headers.get("content-type"), await request.body())
+    validas, resultados = validate_rows(filas, EstacionCreate)
+    unicas, vistas = [], set()
+    for i, estacion in validas:
+        if estacion.nombre_estacion in vistas:
+            resultados.append({"fila": i, "estado": "duplicado", "error": "nombre_estacion repetido en el lote"})
+        else:
+            vistas.add(estacion.nombre_estacion)
+            unicas.append((i, estacion))
+    try:
+        creadas = await crud.crear_estaciones_lote(session, [estacion for _, estacion in unicas])
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"Error en carga masiva de estaciones: {e}")
+        raise HTTPException(status_code=400, detail="Error al crear estaciones")
+    for i, estacion in unicas:
+        if estacion.nombre_estacion in creadas:
+            resultados.append({"fila": i, "estado": "creado", "id": creadas[estacion.nombre_estacion]})
+        else:
+            resultados.append({"fila": i, "estado": "duplicado", "error": "nombre_estacion ya existe"})
+    resultados.sort(key=lambda r: r["fila"])
+    return {"creados": len(creadas), "rechazados": len(resultados) - len(creadas), "resultados": resultados}
+
+@router.delete("/estaciones", tags=["Estaciones API"])
+async def delete_estaciones_bulk_api(payload: IdsRequest, session: AsyncSession = Depends(get_async_db)):
+    """Elimina varias estaciones con una sola sentencia e informa los ids que no existían."""
+    ids = unique_ids(payload.ids)
+    eliminadas = await crud.eliminar_estaciones_lote(session, ids)
+    encontradas = {estacion.id for estacion in eliminadas}
+    return {
+        "eliminados": [i for i in ids if i in encontradas],
+        "no_encontrados": [i for i in ids if i not in encontradas],
+    }
 
 @router.delete("/estaciones/{estacion_id}", tags=["Estaciones API"])
 async def delete_estacion_api(
     estacion_id: int,
     session: AsyncSession = Depends(get_async_db)
 ):
-    estacion_to_delete_list = await crud.obtener_estaciones(session, estacion_id=estacion_id)
-    if not estacion_to_delete_list:
+    if not await crud.eliminar_estacion(session, estacion_id):
         raise HTTPException(status_code=404, detail="Estación no encontrada")
-
-    estacion_obj = estacion_to_delete_list[0]
-
-    resultado = await crud.eliminar_estacion(session, estacion_id) 
-    if not resultado:
-        raise HTTPException(status_code=404, detail="Error al eliminar la estación")
-
-    historial_eliminados.append({
-        "tipo": "estacion",
-        "id": estacion_obj.id,
-        "nombre_estacion": estacion_obj.nombre_estacion,
-        "localidad": estacion_obj.localidad,
-        "fecha_hora": datetime.now().isoformat()
-    })
     return {"mensaje": "Estación eliminada"}
 
 @router.post("/estaciones/update/{estacion_id}", tags=["Estaciones API"])
@@ -270,6 +394,60 @@ async def actualizar_estacion_post(
     return RedirectResponse(url="/update", status_code=status.HTTP_303_SEE_OTHER)
 
 
+# -------------------- EXPORT API --------------------
+def _export_response(request: Request, nombre: str, query: str, args: list, formato: str, gzip: bool) -> StreamingResponse:
+    cookies = dict(request.cookies)
+    extension = "csv" if formato == "csv" else "ndjson"
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    archivo = f"{nombre}.{extension}"
+    if gzip:
+        media_type = "application/gzip"
+        archivo += ".gz"
+    return StreamingResponse(
+        export.copy_export(lambda: read_session(cookies), query, args, formato, comprimir=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{archivo}"'},
+    )
+
+@router.get("/export/buses", tags=["Export API"])
+async def export_buses_api(
+    request: Request,
+    bus_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    formato: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    """Exporta la flota completa (o filtrada) con COPY TO STDOUT, en CSV o NDJSON."""
+    query, args = export.buses_query(bus_id, tipo, activo, nombre)
+    return _export_response(request, "buses", query, args, formato, gzip)
+
+@router.get("/export/estaciones", tags=["Export API"])
+async def export_estaciones_api(
+    request: Request,
+    estacion_id: Optional[int] = None,
+    localidad: Optional[str] = None,
+    activo: Optional[bool] = None,
+    nombre: Optional[str] = None,
+    formato: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    """Exporta la red de estaciones (o una parte) con COPY TO STDOUT, en CSV o NDJSON."""
+    query, args = export.estaciones_query(estacion_id, localidad, activo, nombre)
+    return _export_response(request, "estaciones", query, args, formato, gzip)
+
+
+# -------------------- RUTAS API --------------------
+@router.get("/rutas/{nombre_ruta}/estaciones", response_model=List[EstacionResponse], tags=["Rutas API"])
+async def get_estaciones_de_ruta_api(nombre_ruta: str, session: AsyncSession = Depends(get_async_read_db)):
+    """Estaciones atendidas por una ruta (p. ej. B74)."""
+    ruta = await crud.obtener_estaciones_por_ruta(session, nombre_ruta)
+    if not ruta:
+        raise HTTPException(status_code=404, detail="Ruta no encontrada")
+    return [EstacionResponse.from_orm(estacion) for estacion in ruta.estaciones]
+
+
 # -------------------- Historial API --------------------
 class HistorialItem(BaseModel):
     tipo: str
@@ -281,5 +459,103 @@ class HistorialItem(BaseModel):
     fecha_hora: str
 
 @router.get("/api/historial", response_model=List[HistorialItem], tags=["Historial API"])
-async def get_historial():
-    return historial_eliminados
+async def get_historial(
+    request: Request,
+    response: Response,
+    tipo: Optional[str] = Query(None, pattern="^(bus|estacion)$"),
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_db)
+):
+    """Eliminaciones de la más reciente a la más antigua, por páginas (X-Next-Cursor)."""
+    registros = await historial.obtener_historial(
+        session, tipo, desde, hasta, before_id=decode_cursor(cursor), limit=limit + 1
+    )
+    pagina, siguiente = split_page(registros, limit)
+    set_next_cursor(response, request.url, siguiente)
+    return [
+        HistorialItem(
+            tipo=r.tipo,
+            id=r.registro_id,
+            nombre_bus=r.nombre_bus,
+            tipo_bus=r.tipo_bus,
+            nombre_estacion=r.nombre_estacion,
+            localidad=r.localidad,
+            fecha_hora=r.fecha_hora.isoformat(),
+        )
+        for r in pagina
+    ]
+
+
+
+# -------------------- MEDIA --------------------
+@router.api_route("/media/{clave:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def media_file(request: Request, clave: str):
+    """Archivos del backend local (STORAGE_BACKEND=local), con Range y ETag fuerte."""
+    storage = get_storage()
+    if not isinstance(storage, LocalBackend):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    try:
+        ruta = storage.path(clave)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return await serve_file(request, clave, ruta)
+
+@router.api_route("/img/{clave:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def image_proxy(request: Request, clave: str):
+    """Imágenes de los buckets de la app servidas desde la caché en disco, con caché inmutable.
+
+    Las claves no se reescriben (por contenido o con uuid), así que el
+    navegador puede guardarlas un año sin revalidar.
+    """
+    if split_key(clave)[0] not in (BUCKET_BUSES, BUCKET_ESTACIONES):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    storage = get_storage()
+    if isinstance(storage, LocalBackend):
+        try:
+            ruta = storage.path(clave)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Imagen no encontrada")
+        return await serve_file(request, clave, ruta, cache_control=IMMUTABLE_CACHE_CONTROL)
+
+    cache = get_image_cache()
+    try:
+        abierta = await cache.open(clave)
+    except StorageError as e:
+        if e.status_code in (400, 404):
+            raise HTTPException(status_code=404, detail="Imagen no encontrada")
+        logging.error(f"Error al traer la imagen {clave} del almacenamiento: {e}")
+        raise HTTPException(status_code=502, detail="Error al obtener la imagen del almacenamiento")
+    except FileNotFoundError:
+        # Desalojada por otros workers en cada intento: caché demasiado chica para la carga.
+        logging.warning(f"La imagen {clave} se desalojó de la caché antes de poder servirla.")
+        raise HTTPException(status_code=503, detail="Imagen no disponible, reintente")
+    return await serve_file(request, clave, clave, cache_control=IMMUTABLE_CACHE_CONTROL, opened=abierta)
+
+# -------------------- Métricas API --------------------
+@router.get("/api/metrics/pool", tags=["Métricas API"])
+async def get_pool_metrics():
+    """Conexiones en uso, histograma de espera y eventos de overflow del pool."""
+    return get_pool_status()
+
+@router.get("/api/metrics/replicas", tags=["Métricas API"])
+async def get_replica_metrics():
+    """Estado de salud de las réplicas de lectura."""
+    return get_replica_status()
+
+@router.get("/api/metrics/queries", tags=["Métricas API"])
+async def get_query_cache_metrics():
+    """Aciertos de la caché de sentencias por firma de filtros."""
+    return cache_stats()
+
+@router.get("/api/metrics/jobs", tags=["Métricas API"])
+async def get_job_metrics(session: AsyncSession = Depends(get_async_db)):
+    """Trabajos en cola por estado (pendiente, en_proceso, muerto) y contadores de los workers."""
+    return await job_status(session)
+
+@router.get("/api/metrics/image-cache", tags=["Métricas API"])
+async def get_image_cache_metrics():
+    """Archivos y bytes de la caché de imágenes, aciertos, fallos agrupados y desalojos."""
+    return get_image_cache().stats()
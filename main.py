@@ -1,23 +1,80 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 
-from app.database.db import async_engine, Base
+import asyncio
+import os
+import time
+
+from app.database.db import get_async_engine, get_replica_router, new_session, dispose_engines, READ_YOUR_WRITES_SECONDS, REPLICA_HEALTH_INTERVAL
+from app.database.migrations import run_migrations
+from app.database.query_log import current_route
+from app.database.replicas import READ_YOUR_WRITES_COOKIE
+from app.services import job_handlers  # noqa: F401  registra los handlers de la cola
+from app.services.jobs import get_job_pool
+from app.services.storage import close_storage, current_base_url
+from app.services.images import shutdown_image_pool
+from app.services.static_assets import FingerprintedStaticFiles, load_static_assets
+from app.operations.historial import HISTORIAL_PRUNE_INTERVAL, HISTORIAL_RETENTION_DAYS, run_historial_pruning
 import home
 
 app = FastAPI()
 
+@app.middleware("http")
+async def route_context(request: Request, call_next):
+    """Deja la ruta actual disponible para el log de consultas lentas y la URL
+    base para las URLs absolutas de imagen de la API."""
+    token = current_route.set(f"{request.method} {request.url.path}")
+    token_base = current_base_url.set(str(request.base_url).rstrip("/"))
+    try:
+        return await call_next(request)
+    finally:
+        current_base_url.reset(token_base)
+        current_route.reset(token)
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Tras una escritura exitosa, el cliente lee del primario durante un tiempo."""
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400 and READ_YOUR_WRITES_SECONDS > 0:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            str(time.time() + READ_YOUR_WRITES_SECONDS),
+            max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
+# Con MIGRATE_ON_STARTUP=false el arranque no toca la base de datos.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
 @app.on_event("startup")
 async def on_startup():
-    await create_db_tables() 
+    await asyncio.to_thread(load_static_assets)
+    if MIGRATE_ON_STARTUP:
+        await run_migrations(get_async_engine())
+    replica_router = get_replica_router()
+    if replica_router.replicas:
+        app.state.replica_health_task = asyncio.create_task(
+            replica_router.run_health_checks(REPLICA_HEALTH_INTERVAL)
+        )
+    get_job_pool().start()
+    if HISTORIAL_RETENTION_DAYS > 0:
+        app.state.historial_prune_task = asyncio.create_task(
+            run_historial_pruning(new_session, HISTORIAL_PRUNE_INTERVAL)
+        )
 
-async def create_db_tables():
-    async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+@app.on_event("shutdown")
+async def on_shutdown():
+    for nombre in ("replica_health_task", "historial_prune_task"):
+        task = getattr(app.state, nombre, None)
+        if task:
+            task.cancel()
+    await get_job_pool().stop()
+    await close_storage()
+    shutdown_image_pool()
+    await dispose_engines()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", FingerprintedStaticFiles(), name="static")
 
 app.include_router(home.router)
-
-templates = Jinja2Templates(directory="templates")
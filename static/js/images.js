@@ -0,0 +1,20 @@
+// <picture> con las variantes redimensionadas (WebP y JPEG) de una imagen.
+// `variantes` es {formato: {ancho: url}}; si no hay variantes se usa el original.
+function srcsetFor(variantes, formato) {
+    return Object.entries((variantes || {})[formato] || {})
+        .map(([ancho, url]) => `${url} ${ancho}w`)
+        .join(', ');
+}
+
+function responsiveImage(url, variantes, alt, sizePx) {
+    const webp = srcsetFor(variantes, 'webp');
+    const jpeg = srcsetFor(variantes, 'jpeg');
+    const sizes = `${sizePx}px`;
+    return `
+        <picture>
+            ${webp ? `<source type="image/webp" srcset="${webp}" sizes="${sizes}">` : ''}
+            <img src="${url}" ${jpeg ? `srcset="${jpeg}" sizes="${sizes}"` : ''}
+                 alt="${alt}" loading="lazy" decoding="async" style="max-width: ${sizes};">
+        </picture>
+    `;
+}
@@ -0,0 +1,95 @@
+// Paginación por cursor (cabecera X-Next-Cursor) con carga al hacer scroll.
+// Cada página se agrega al contenedor con un DocumentFragment, sin reescribir
+// el innerHTML de lo que ya está en pantalla. Si una página falla, el
+// centinela muestra un botón para reintentar y se vuelve a observar tras una
+// espera creciente, así el scroll infinito no se detiene en silencio.
+const RETRY_BASE_MS = 2000;
+const RETRY_MAX_MS = 30000;
+
+function htmlToElement(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+}
+
+function createPager({ buildUrl, container, sentinel, renderItem, onEmpty, root }) {
+    let cursor = null;
+    let done = false;
+    let loading = false;
+    let generation = 0;
+    let loaded = 0;
+    let failures = 0;
+    let retryTimer = null;
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadNext();
+        }
+    }, { root: root || null, rootMargin: '200px' });
+
+    function watch() {
+        // Si el centinela sigue visible, volver a observarlo dispara la siguiente página.
+        observer.unobserve(sentinel);
+        if (!done) observer.observe(sentinel);
+    }
+
+    function showRetry() {
+        sentinel.innerHTML = '';
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'btn';
+        button.textContent = 'Error al cargar. Reintentar';
+        button.addEventListener('click', loadNext);
+        sentinel.appendChild(button);
+        const delay = Math.min(RETRY_BASE_MS * 2 ** (failures - 1), RETRY_MAX_MS);
+        retryTimer = setTimeout(() => { retryTimer = null; watch(); }, delay);
+    }
+
+    async function loadNext() {
+        if (loading || done) return;
+        loading = true;
+        clearTimeout(retryTimer);
+        retryTimer = null;
+        observer.unobserve(sentinel);
+        const current = generation;
+        try {
+            const response = await fetch(buildUrl(cursor));
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const items = await response.json();
+            if (current !== generation) return;
+            cursor = response.headers.get('X-Next-Cursor');
+            done = !cursor;
+            failures = 0;
+            sentinel.innerHTML = '';
+            const fragment = document.createDocumentFragment();
+            items.forEach(item => fragment.appendChild(renderItem(item)));
+            container.appendChild(fragment);
+            loaded += items.length;
+            if (loaded === 0 && onEmpty) onEmpty();
+            watch();
+        } catch (error) {
+            if (current !== generation) return;
+            console.error('Error al cargar la página:', error);
+            failures++;
+            showRetry();
+        } finally {
+            if (current === generation) loading = false;
+        }
+    }
+
+    function reset() {
+        generation++;
+        cursor = null;
+        done = false;
+        loading = false;
+        loaded = 0;
+        failures = 0;
+        clearTimeout(retryTimer);
+        retryTimer = null;
+        sentinel.innerHTML = '';
+        container.innerHTML = '';
+        watch();
+    }
+
+    return { reset, loadNext };
+}